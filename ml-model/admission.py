@@ -0,0 +1,223 @@
+"""
+Memory-aware admission control for image endpoints
+Requests declare what they will hold in memory (payload, encoded bytes, the
+decoded full-resolution image and any working arrays), estimated from the
+image header before anything is decoded. A request is admitted only while the
+sum over all in-flight requests stays within the memory budget; otherwise it
+waits in a short bounded queue and is rejected when that fills up or times out.
+A request that only learns later that it needs more (a cascade escalating to its
+expensive stage) resizes its reservation, giving up what it holds while it
+waits, so growing requests never hold memory while waiting on each other.
+
+While requests are in flight a sampler reads the process RSS from
+/proc/self/statm every few milliseconds, so each request can report the peak
+RSS seen during its lifetime.
+"""
+import os
+import time
+import threading
+
+
+class AdmissionError(Exception):
+    status = 503
+    retry_after = None
+
+
+class PixelBudgetExceeded(AdmissionError):
+    status = 413
+
+
+class MemoryBudgetExceeded(AdmissionError):
+    """The request alone is larger than the whole in-flight budget"""
+    status = 413
+
+
+class AdmissionRejected(AdmissionError):
+    """The budget is busy and the request could not be queued in time"""
+    status = 503
+    retry_after = 1
+
+
+def total_memory_bytes():
+    """cgroup memory limit (v2, then v1) when set, else physical memory"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value != "max" and int(value) < 1 << 60:
+                return int(value)
+        except (OSError, ValueError):
+            pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """Samples RSS only while at least one ticket is active"""
+
+    def __init__(self, interval_ms=5.0):
+        self.interval = interval_ms / 1000.0
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._active = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.available = self.read() is not None
+
+    def read(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def track(self, ticket):
+        if not self.available:
+            return
+        rss = self.read()
+        ticket.rss_start = ticket.peak_rss = rss
+        with self._lock:
+            self._active.add(ticket)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="rss-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def untrack(self, ticket):
+        if not self.available:
+            return
+        rss = self.read()
+        with self._lock:
+            self._active.discard(ticket)
+        if rss is not None:
+            ticket.peak_rss = max(ticket.peak_rss or 0, rss)
+
+    def _loop(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._wake.clear()
+                    continue
+            rss = self.read()
+            if rss is not None:
+                for ticket in active:
+                    if rss > (ticket.peak_rss or 0):
+                        ticket.peak_rss = rss
+            time.sleep(self.interval)
+
+
+class Ticket:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+        self.peak_nbytes = nbytes
+        self.waited_ms = 0.0
+        self.rss_start = None
+        self.peak_rss = None
+
+    def report(self):
+        mb = lambda b: round(b / 1e6, 1) if b is not None else None
+        return {
+            'estimate_mb': mb(self.peak_nbytes),
+            'waited_ms': round(self.waited_ms, 1),
+            'rss_start_mb': mb(self.rss_start),
+            'peak_rss_mb': mb(self.peak_rss),
+        }
+
+
+class AdmissionController:
+    def __init__(self, memory_budget, max_pixels, queue_timeout=10.0, max_waiting=16, sample_interval_ms=5.0):
+        self.memory_budget = memory_budget
+        self.max_pixels = max_pixels
+        self.queue_timeout = queue_timeout
+        self.max_waiting = max_waiting
+        self.sampler = RssSampler(sample_interval_ms)
+        self.in_flight = 0
+        self.waiting = 0
+        self.counters = {'admitted': 0, 'resized': 0, 'queued': 0, 'rejected_pixels': 0, 'rejected_memory': 0,
+                         'rejected_busy': 0}
+        self.peak_rss = 0
+        self._cond = threading.Condition()
+
+    def check_pixels(self, header):
+        pixels = header['width'] * header['height']
+        if self.max_pixels and pixels > self.max_pixels:
+            with self._cond:
+                self.counters['rejected_pixels'] += 1
+            raise PixelBudgetExceeded(
+                f"Image is {header['width']}x{header['height']} ({pixels / 1e6:.1f} MP); "
+                f"the limit is {self.max_pixels / 1e6:.1f} MP"
+            )
+
+    def acquire(self, nbytes):
+        ticket = Ticket(nbytes)
+        with self._cond:
+            self._reserve(ticket, nbytes)
+            self.counters['admitted'] += 1
+        self.sampler.track(ticket)
+        return ticket
+
+    def resize(self, ticket, nbytes):
+        """Change a held reservation (e.g. a cascade escalating to a more expensive stage).
+
+        Growing gives up the bytes already held while it waits, so requests that
+        grow can never block each other; if it is rejected the ticket holds nothing.
+        """
+        with self._cond:
+            self.in_flight -= ticket.nbytes
+            ticket.nbytes = 0
+            self._cond.notify_all()
+            self._reserve(ticket, nbytes)
+            ticket.peak_nbytes = max(ticket.peak_nbytes, nbytes)
+            self.counters['resized'] += 1
+
+    def _reserve(self, ticket, nbytes):
+        """Wait for room for ``nbytes`` and add it to ``ticket``; called with the condition held"""
+        if nbytes > self.memory_budget:
+            self.counters['rejected_memory'] += 1
+            raise MemoryBudgetExceeded(
+                f"Request needs ~{nbytes / 1e6:.0f} MB, above the {self.memory_budget / 1e6:.0f} MB "
+                f"in-flight budget - send fewer or smaller images"
+            )
+        if self.in_flight + nbytes > self.memory_budget:
+            if self.waiting >= self.max_waiting:
+                self.counters['rejected_busy'] += 1
+                raise AdmissionRejected("Server is at its image memory budget - retry shortly")
+            self.waiting += 1
+            self.counters['queued'] += 1
+            start = time.perf_counter()
+            try:
+                admitted = self._cond.wait_for(
+                    lambda: self.in_flight + nbytes <= self.memory_budget, timeout=self.queue_timeout
+                )
+            finally:
+                self.waiting -= 1
+            ticket.waited_ms += (time.perf_counter() - start) * 1000
+            if not admitted:
+                self.counters['rejected_busy'] += 1
+                raise AdmissionRejected("Server is at its image memory budget - retry shortly")
+        self.in_flight += nbytes
+        ticket.nbytes = nbytes
+
+    def release(self, ticket):
+        self.sampler.untrack(ticket)
+        with self._cond:
+            self.in_flight -= ticket.nbytes
+            if ticket.peak_rss and ticket.peak_rss > self.peak_rss:
+                self.peak_rss = ticket.peak_rss
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self.counters,
+                memory_budget_mb=round(self.memory_budget / 1e6, 1),
+                max_pixels=self.max_pixels,
+                in_flight_mb=round(self.in_flight / 1e6, 1),
+                waiting=self.waiting,
+                rss_mb=round(self.sampler.read() / 1e6, 1) if self.sampler.available else None,
+                peak_rss_mb=round(self.peak_rss / 1e6, 1) if self.peak_rss else None,
+            )
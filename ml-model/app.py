@@ -2,63 +2,156 @@
 Mira ML Service - Breast Cancer & Chest X-ray Analysis
 Uses torchxrayvision with DenseNet121 for both chest X-rays and mammography
 DenseNet121 is a state-of-the-art medical imaging model trained on 112,000 X-rays
+
+This is the single ML gateway: it also serves the Wisconsin breast cancer
+predictor (/breast-cancer/*, plus /predict and /predict-from-image as before)
+and the statistical mammography screen (/mammography/statistical) that used to
+run as separate services on ports 5001 and 5002. Their old URLs are kept under
+/breast-service/* and /mammography-service/*.
 """
-import io
+import atexit
 import base64
+import collections
+import contextlib
+import functools
+import hashlib
+import hmac
+import io
 import json
+import multiprocessing
 import os
+import threading
+import time
 import numpy as np
 import sys
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify, send_from_directory, after_this_request, has_request_context
 import torch
 import torchxrayvision as xrv
 import torchvision.transforms as T
 from PIL import Image
 import warnings
+from admission import AdmissionController, AdmissionError, total_memory_bytes
+from autotune import calibrate, load_profile, save_profile, usable_cpus
+from batching import MicroBatcher
+from embedding_index import EmbeddingIndex
+from fast_json import FastJSONProvider
+from model_registry import ModelRegistry
+from preprocess_pool import PreprocessPool
+from profiling import ProfilingTools
+from shadow import ShadowCandidate, ShadowEvaluator
+from preprocessing import (
+    QUALITY_GATE, QUALITY_THUMBNAIL_SIZE,
+    decode_image, decode_payload, read_image_header, decoded_size,
+    make_thumbnail, image_to_array, assess_thumbnail_quality, extract_mammo_features,
+)
 warnings.filterwarnings('ignore')
-try:
-    import joblib
-except Exception:
-    joblib = None
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+# Shared model registry - every route, including the ones that used to be
+# separate services on ports 5001/5002, reads its models from here
+MODEL_DIR = os.path.dirname(__file__)
+registry = ModelRegistry()
+
+# Torch threading / batch size profile written by autotune.py. AUTOTUNE_ON_BOOT: 'off' (only apply
+# a saved profile), 'missing' (calibrate when no profile matches this hardware) or 'always'.
+# TORCH_NUM_THREADS, TORCH_INTEROP_THREADS and BATCH_MAX_SIZE override the profile.
+AUTOTUNE_PROFILE = os.environ.get('AUTOTUNE_PROFILE', os.path.join(MODEL_DIR, "autotune_profile.json"))
+AUTOTUNE_ON_BOOT = os.environ.get('AUTOTUNE_ON_BOOT', 'off')
+AUTOTUNE_MAX_LATENCY_MS = float(os.environ.get('AUTOTUNE_MAX_LATENCY_MS', '500'))
+TORCH_NUM_THREADS = int(os.environ.get('TORCH_NUM_THREADS', '0'))
+TORCH_INTEROP_THREADS = int(os.environ.get('TORCH_INTEROP_THREADS', '0'))
+TUNING = load_profile(AUTOTUNE_PROFILE) if AUTOTUNE_ON_BOOT != 'always' else None
+
+def apply_torch_threads(profile):
+    """Size torch's thread pools; the inter-op pool can only be sized before its first use"""
+    threads = TORCH_NUM_THREADS or (profile or {}).get('torch_threads')
+    interop = TORCH_INTEROP_THREADS or (profile or {}).get('interop_threads')
+    if threads:
+        torch.set_num_threads(threads)
+    if interop:
+        try:
+            torch.set_num_interop_threads(interop)
+        except RuntimeError:
+            print("[AUTOTUNE] Inter-op thread pool already started - keeping its size")
+
+apply_torch_threads(TUNING)
 
 # Load models at startup
 print("Loading models...")
-models = {
-    'densenet121': xrv.models.DenseNet(weights='densenet121-res224-all'),
-}
+registry.register('densenet121', xrv.models.DenseNet(weights='densenet121-res224-all'), 'torch',
+                  source='densenet121-res224-all')
+models = registry
 models['densenet121'].eval()
 
+if TUNING is None and AUTOTUNE_ON_BOOT in ('missing', 'always') and multiprocessing.parent_process() is None:
+    print("[AUTOTUNE] Calibrating torch threads, batch size and memory format...")
+    TUNING = calibrate(models['densenet121'], max_latency_ms=AUTOTUNE_MAX_LATENCY_MS)
+    try:
+        save_profile(TUNING, AUTOTUNE_PROFILE)
+        print(f"[AUTOTUNE] Profile saved to {AUTOTUNE_PROFILE} ({TUNING['calibration_seconds']}s)")
+    except OSError as e:
+        print(f"[AUTOTUNE] Could not save profile: {e}")
+    apply_torch_threads(TUNING)
+elif TUNING is not None and TUNING.get('channels_last'):
+    models['densenet121'].to(memory_format=torch.channels_last)
+if TUNING is not None:
+    print(f"[AUTOTUNE] Using threads={torch.get_num_threads()} batch={TUNING['batch_size']} "
+          f"channels_last={TUNING['channels_last']}")
+
 # Mammography RF model (from trained_model folder)
 MAMMO_MODEL = None
 MAMMO_SCALER = None
 MAMMO_CLASSES = None
 try:
-    if joblib:
-        # Try new trained_model folder first
-        model_path = os.path.join(os.path.dirname(__file__), "trained_model", "breast_cancer_model.joblib")
-        scaler_path = os.path.join(os.path.dirname(__file__), "trained_model", "breast_cancer_scaler.joblib")
-        classes_path = os.path.join(os.path.dirname(__file__), "trained_model", "classes.json")
-        
-        if os.path.exists(model_path) and os.path.exists(scaler_path):
-            MAMMO_MODEL = joblib.load(model_path)
-            MAMMO_SCALER = joblib.load(scaler_path)
-            with open(classes_path, 'r') as f:
-                MAMMO_CLASSES = json.load(f)
-            print(f"[MAMMOGRAPHY] Trained model loaded: {MAMMO_CLASSES}")
-        else:
-            # Fall back to old model
-            mammo_model_path = os.path.join(os.path.dirname(__file__), "breast_cancer_model.joblib")
-            mammo_scaler_path = os.path.join(os.path.dirname(__file__), "breast_cancer_scaler.joblib")
-            if os.path.exists(mammo_model_path) and os.path.exists(mammo_scaler_path):
-                MAMMO_MODEL = joblib.load(mammo_model_path)
-                MAMMO_SCALER = joblib.load(mammo_scaler_path)
-                MAMMO_CLASSES = {"names": ["malignant", "benign"]}
-                print("[MAMMOGRAPHY] Legacy RF model loaded")
+    # Try new trained_model folder first
+    model_path = os.path.join(MODEL_DIR, "trained_model", "breast_cancer_model.joblib")
+    scaler_path = os.path.join(MODEL_DIR, "trained_model", "breast_cancer_scaler.joblib")
+    classes_path = os.path.join(MODEL_DIR, "trained_model", "classes.json")
+    
+    if os.path.exists(model_path) and os.path.exists(scaler_path):
+        MAMMO_MODEL = registry.load_joblib('mammography_rf', model_path)
+        MAMMO_SCALER = registry.load_joblib('mammography_scaler', scaler_path)
+        with open(classes_path, 'r') as f:
+            MAMMO_CLASSES = json.load(f)
+        print(f"[MAMMOGRAPHY] Trained model loaded: {MAMMO_CLASSES}")
+    else:
+        # Fall back to old model
+        mammo_model_path = os.path.join(MODEL_DIR, "breast_cancer_model.joblib")
+        mammo_scaler_path = os.path.join(MODEL_DIR, "breast_cancer_scaler.joblib")
+        if os.path.exists(mammo_model_path) and os.path.exists(mammo_scaler_path):
+            MAMMO_MODEL = registry.load_joblib('mammography_rf', mammo_model_path)
+            MAMMO_SCALER = registry.load_joblib('mammography_scaler', mammo_scaler_path)
+            MAMMO_CLASSES = {"names": ["malignant", "benign"]}
+            print("[MAMMOGRAPHY] Legacy RF model loaded")
 except Exception as e:
     print(f"[MAMMOGRAPHY] Failed to load model: {e}")
 
+# Wisconsin breast cancer RF (formerly breast-cancer-service.py); shares its files
+# with the legacy mammography RF, so the registry holds a single copy
+BREAST_MODEL = None
+BREAST_SCALER = None
+try:
+    BREAST_MODEL = registry.load_joblib('breast_cancer_rf', os.path.join(MODEL_DIR, "breast_cancer_model.joblib"))
+    BREAST_SCALER = registry.load_joblib('breast_cancer_scaler', os.path.join(MODEL_DIR, "breast_cancer_scaler.joblib"))
+    print("[BREAST CANCER] Model loaded")
+except Exception as e:
+    print(f"[BREAST CANCER] Model load failed: {e}")
+BREAST_MODEL_AVAILABLE = BREAST_MODEL is not None and BREAST_SCALER is not None
+
+BREAST_FEATURE_NAMES = [
+    "radius_mean", "texture_mean", "perimeter_mean", "area_mean",
+    "smoothness_mean", "compactness_mean", "concavity_mean", "concave_points_mean",
+    "symmetry_mean", "fractal_dimension_mean",
+    "radius_se", "texture_se", "perimeter_se", "area_se",
+    "smoothness_se", "compactness_se", "concavity_se", "concave_points_se",
+    "symmetry_se", "fractal_dimension_se",
+    "radius_worst", "texture_worst", "perimeter_worst", "area_worst",
+    "smoothness_worst", "compactness_worst", "concavity_worst", "concave_points_worst",
+    "symmetry_worst", "fractal_dimension_worst"
+]
+
 # Define pathologies we can detect
 PATHOLOGIES = [
     'Atelectasis',
@@ -78,98 +171,346 @@ PATHOLOGIES = [
     'Support Devices'
 ]
 
+# Mass-like DenseNet outputs used for the breast analysis ('Mass', 'Nodule', 'Lung Lesion', 'Consolidation')
+MAMMO_MASS_INDICES = [15, 14, 11, 1]
+
+# DenseNet121 output order
+XRV_PATHOLOGIES = [
+    'Atelectasis', 'Consolidation', 'Infiltration', 'Pneumothorax', 'Edema',
+    'Emphysema', 'Fibrosis', 'Effusion', 'Pneumonia', 'Pleural_Thickening',
+    'Cardiomegaly', 'Lung Lesion', 'Fracture', 'Lung Opacity', 'Support Devices',
+    'Nodule', 'Mass', 'Hernia'
+]
+
+# Clinical significance mapping
+CLINICAL_SIGNIFICANCE = {
+    'Mass': {'category': 'Structural', 'urgency': 'high', 'location': 'Lung parenchyma', 'clinical': 'May indicate malignancy or benign tumor'},
+    'Nodule': {'category': 'Structural', 'urgency': 'high', 'location': 'Lung parenchyma', 'clinical': 'Requires follow-up, may be benign or malignant'},
+    'Lung Lesion': {'category': 'Structural', 'urgency': 'high', 'location': 'Lung parenchyma', 'clinical': 'Undefined lesion requiring further investigation'},
+    'Pneumonia': {'category': 'Infection', 'urgency': 'high', 'location': 'Lung fields', 'clinical': 'Infection requiring medical attention'},
+    'Pneumothorax': {'category': 'Emergency', 'urgency': 'critical', 'location': 'Pleural space', 'clinical': 'Emergency - immediate attention required'},
+    'Effusion': {'category': 'Fluid', 'urgency': 'medium', 'location': 'Pleural space', 'clinical': 'Fluid accumulation, may require thoracentesis'},
+    'Consolidation': {'category': 'Infection', 'urgency': 'medium', 'location': 'Lung fields', 'clinical': 'May indicate pneumonia or other infection'},
+    'Atelectasis': {'category': 'Collapse', 'urgency': 'medium', 'location': 'Lung fields', 'clinical': 'Lung collapse - may be postoperative or obstructive'},
+    'Cardiomegaly': {'category': 'Cardiac', 'urgency': 'medium', 'location': 'Mediastinum', 'clinical': 'Enlarged heart - cardiac evaluation recommended'},
+    'Edema': {'category': 'Fluid', 'urgency': 'high', 'location': 'Lung fields', 'clinical': 'Pulmonary edema - cardiac workup recommended'},
+    'Fibrosis': {'category': 'Chronic', 'urgency': 'low', 'location': 'Lung parenchyma', 'clinical': 'Chronic interstitial changes'},
+    'Emphysema': {'category': 'Chronic', 'urgency': 'low', 'location': 'Lung parenchyma', 'clinical': 'COPD-related changes'},
+    'Infiltration': {'category': 'Infection', 'urgency': 'medium', 'location': 'Lung fields', 'clinical': 'Possible infection or inflammation'},
+    'Pleural_Thickening': {'category': 'Structural', 'urgency': 'low', 'location': 'Pleura', 'clinical': 'Usually benign, may need monitoring'},
+    'Fracture': {'category': 'Trauma', 'urgency': 'medium', 'location': 'Ribs/osseous', 'clinical': 'Traumatic - pain management required'},
+    'Hernia': {'category': 'Structural', 'urgency': 'low', 'location': 'Diaphragm', 'clinical': 'Usually congenital or surgical'},
+    'Lung Opacity': {'category': 'General', 'urgency': 'medium', 'location': 'Lung fields', 'clinical': 'Non-specific opacity - further evaluation needed'},
+    'Support Devices': {'category': 'Iatrogenic', 'urgency': 'low', 'location': 'Various', 'clinical': 'Medical devices present - normal for patient'}
+}
+
+
+DENSENET_MODEL_INFO = {
+    'name': 'DenseNet121',
+    'architecture': '121-layer Dense Convolutional Network',
+    'training_data': 'NIH ChestX-ray14 + ChestNet',
+    'accuracy': '94.5%',
+    'auc': '0.89',
+    'f1_score': '0.87'
+}
+
+# Chest X-ray specific model info returned by /analyze
+CHEST_XRAY_MODEL_INFO = {
+    'name': 'DenseNet121',
+    'architecture': '121-layer Dense Convolutional Network',
+    'pretraining': 'ImageNet',
+    'finetuning': 'NIH ChestX-ray14 + CheXpert',
+    'primary_use': 'Chest radiograph interpretation',
+    'performance': {
+        'accuracy': '94.5%',
+        'auc_roc': '0.89',
+        'sensitivity': '0.85',
+        'specificity': '0.92'
+    },
+    'limitations': 'Model may have reduced sensitivity for subtle findings. Clinical correlation recommended.'
+}
+
+CHEST_XRAY_DISCLAIMER = 'This is an AI-assisted screening tool, not a medical diagnosis. Consult a healthcare professional for medical advice.'
+
+# Everything static in an analysis response, served once by /metadata and referenced by
+# version id from compact responses (the id changes whenever any of it changes)
+METADATA = {
+    'pathologies': XRV_PATHOLOGIES,
+    'probability_scale': 'percent',
+    'clinical_significance': CLINICAL_SIGNIFICANCE,
+    'model_info': {'densenet121': DENSENET_MODEL_INFO, 'chest_xray': CHEST_XRAY_MODEL_INFO},
+    'risk_levels': {'high': 65, 'medium': 40},
+    'disclaimer': CHEST_XRAY_DISCLAIMER,
+}
+METADATA_VERSION = hashlib.sha256(json.dumps(METADATA, sort_keys=True).encode()).hexdigest()[:12]
+METADATA_MAX_AGE = int(os.environ.get('METADATA_MAX_AGE', '86400'))
+
+# Mammography analysis mode: 'auto' (RF when available, else DenseNet), 'rf', 'densenet', 'tiled' or 'cascade'
+MAMMO_MODE = os.environ.get('MAMMO_MODE', 'auto')
+
+# Tiled high-resolution inference settings
+MAMMO_TILE_SIZE = int(os.environ.get('MAMMO_TILE_SIZE', '224'))
+MAMMO_TILE_STRIDE = int(os.environ.get('MAMMO_TILE_STRIDE', '224'))
+MAMMO_TILE_MAX_SIDE = int(os.environ.get('MAMMO_TILE_MAX_SIDE', '2048'))
+MAMMO_TILE_BATCH = int(os.environ.get('MAMMO_TILE_BATCH', '16'))
+MAMMO_TILE_BUDGET = int(os.environ.get('MAMMO_TILE_BUDGET', '64'))
+MAMMO_TILE_TIME_BUDGET_MS = float(os.environ.get('MAMMO_TILE_TIME_BUDGET_MS', '5000'))
+MAMMO_TILE_TISSUE_THRESHOLD = float(os.environ.get('MAMMO_TILE_TISSUE_THRESHOLD', '0.12'))
+MAMMO_TILE_MIN_TISSUE = float(os.environ.get('MAMMO_TILE_MIN_TISSUE', '0.3'))
+
+# Optional multi-process preprocessing (decode/resize/normalize off the GIL, into shared memory).
+# Workers re-import the __main__ module, so the pool is only started from the top-level process
+# and when __main__ is not one of this service's own scripts (i.e. when served via `flask run`).
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', '0'))
+PREPROCESS_SLOTS = int(os.environ.get('PREPROCESS_SLOTS', '0')) or None
+PREPROCESS_TIMEOUT = float(os.environ.get('PREPROCESS_TIMEOUT', '30'))
+PREPROCESS_POOL = None
+_MAIN_FILE = getattr(sys.modules.get('__main__'), '__file__', None) or ''
+if PREPROCESS_WORKERS > 0 and multiprocessing.parent_process() is None:
+    if os.path.dirname(os.path.abspath(_MAIN_FILE)) == os.path.dirname(os.path.abspath(__file__)):
+        print("[PREPROCESS] Pool disabled when a service script is run directly - start with `flask run` to enable it")
+    else:
+        PREPROCESS_POOL = PreprocessPool(
+            PREPROCESS_WORKERS,
+            slots=PREPROCESS_SLOTS,
+            thumbnail_size=QUALITY_THUMBNAIL_SIZE,
+            timeout=PREPROCESS_TIMEOUT,
+        )
+        atexit.register(PREPROCESS_POOL.close)
+        print(f"[PREPROCESS] Pool started: {PREPROCESS_WORKERS} workers, {PREPROCESS_POOL.num_slots} tensor slots")
+
+# Penultimate-layer DenseNet embeddings for longitudinal comparison
+EMBEDDING_INDEX_DIR = os.environ.get('EMBEDDING_INDEX_DIR', os.path.join(os.path.dirname(__file__), "embeddings"))
+EMBEDDINGS = EmbeddingIndex(EMBEDDING_INDEX_DIR, dim=models['densenet121'].classifier.in_features)
+EMBEDDING_SEARCH_MAX_K = int(os.environ.get('EMBEDDING_SEARCH_MAX_K', '100'))
+
+# Shared DenseNet batching queue: concurrent requests are run as one forward pass (BATCH_MAX_SIZE=1 disables)
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', (TUNING or {}).get('batch_size', 8)))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '2'))
+DENSENET_BATCHER = None
+if BATCH_MAX_SIZE > 1:
+    DENSENET_BATCHER = MicroBatcher(
+        lambda x: forward_with_embedding(models['densenet121'], x),
+        max_batch=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        name='densenet121-batcher',
+    )
+
+# Multi-weight ensemble for /analyze: ENSEMBLE_WEIGHTS lists extra xrv DenseNet weights (e.g.
+# densenet121-res224-nih,densenet121-res224-chex,densenet121-res224-mimic_ch) that run next to
+# densenet121 on the same preprocessed tensor. Every member has its own batching queue, so members run
+# in parallel and concurrent requests still batch per member. Requests opt in with "ensemble": true;
+# ENSEMBLE_DEFAULT=1 makes it the default for /analyze.
+# Each member's forward uses torch's whole intra-op pool, so N parallel members run up to N x torch
+# threads on the same cores. That only pays off with spare cores; on a saturated machine the members
+# contend with each other and with every other request. benchmark_ensemble.py measures both modes and
+# the slowdown an ensemble load causes single-model requests; ENSEMBLE_PARALLEL=0 runs the members one
+# after another (still through their batching queues) instead.
+ENSEMBLE_WEIGHTS = [w.strip() for w in os.environ.get('ENSEMBLE_WEIGHTS', '').split(',') if w.strip()]
+ENSEMBLE_DEFAULT = os.environ.get('ENSEMBLE_DEFAULT', '0') == '1'
+ENSEMBLE_PARALLEL = os.environ.get('ENSEMBLE_PARALLEL', '1') == '1'
+ENSEMBLE_MEMBERS = {}
+ENSEMBLE_LOCK = threading.Lock()
+ENSEMBLE_LATENCY = {'single': collections.deque(maxlen=500), 'ensemble': collections.deque(maxlen=500)}
+if ENSEMBLE_WEIGHTS:
+    member_names = ['densenet121']
+    for weights in ENSEMBLE_WEIGHTS:
+        name = 'ensemble_' + weights.replace('densenet121-res224-', '')
+        try:
+            registry.register(name, xrv.models.DenseNet(weights=weights).eval(), 'torch', source=weights)
+        except Exception as e:
+            print(f"[ENSEMBLE] Failed to load {weights}: {e}")
+            continue
+        if TUNING is not None and TUNING.get('channels_last'):
+            models[name].to(memory_format=torch.channels_last)
+        member_names.append(name)
+    if len(member_names) > 1:
+        for name in member_names:
+            if name == 'densenet121' and DENSENET_BATCHER is not None:
+                ENSEMBLE_MEMBERS[name] = DENSENET_BATCHER
+                continue
+            ENSEMBLE_MEMBERS[name] = MicroBatcher(
+                lambda x, name=name: forward_with_embedding(models[name], x),
+                max_batch=max(1, BATCH_MAX_SIZE),
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                name=f'{name}-batcher',
+            )
+        print(f"[ENSEMBLE] {len(ENSEMBLE_MEMBERS)} members ({'parallel' if ENSEMBLE_PARALLEL else 'sequential'}): "
+              f"{list(ENSEMBLE_MEMBERS)}")
+        if ENSEMBLE_PARALLEL and len(ENSEMBLE_MEMBERS) * torch.get_num_threads() > usable_cpus():
+            print(f"[ENSEMBLE] Warning: {len(ENSEMBLE_MEMBERS)} members x {torch.get_num_threads()} torch threads "
+                  f"oversubscribe {usable_cpus()} CPUs - check benchmark_ensemble.py, or set ENSEMBLE_PARALLEL=0")
+
+# Confidence cascade: the RF answers alone when it is at least this sure, otherwise DenseNet runs
+CASCADE_BENIGN_THRESHOLD = float(os.environ.get('CASCADE_BENIGN_THRESHOLD', '0.9'))
+CASCADE_MALIGNANT_THRESHOLD = float(os.environ.get('CASCADE_MALIGNANT_THRESHOLD', '0.9'))
+CASCADE_EXPENSIVE_MODE = os.environ.get('CASCADE_EXPENSIVE_MODE', 'densenet')  # 'densenet' or 'tiled'
+CASCADE_LOCK = threading.Lock()
+CASCADE_STATS = {'requests': 0, 'rf_exit_benign': 0, 'rf_exit_malignant': 0, 'escalated': 0}
+
+# Memory-aware admission for image endpoints: dimensions are read from the image header before
+# decoding, each image must fit ADMISSION_MAX_PIXELS and the estimated memory of all in-flight
+# requests must fit the budget (0: a quarter of the machine / cgroup memory). Requests over budget
+# wait up to ADMISSION_QUEUE_TIMEOUT seconds, and are rejected once ADMISSION_MAX_WAITING are queued.
+ADMISSION_MAX_PIXELS = int(os.environ.get('ADMISSION_MAX_PIXELS', '50000000'))
+ADMISSION_MEMORY_BUDGET_MB = float(os.environ.get('ADMISSION_MEMORY_BUDGET_MB', '0'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '10'))
+ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', '16'))
+# Peak activation memory of one 224x224 image in a DenseNet121 forward pass (measured ~30-37 MB)
+ADMISSION_FORWARD_MB = float(os.environ.get('ADMISSION_FORWARD_MB', '40'))
+MAX_REQUEST_MB = float(os.environ.get('MAX_REQUEST_MB', '64'))
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_REQUEST_MB * 1e6)
+ADMISSION = AdmissionController(
+    int(ADMISSION_MEMORY_BUDGET_MB * 1e6) or (total_memory_bytes() or 4_000_000_000) // 4,
+    max_pixels=ADMISSION_MAX_PIXELS,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    max_waiting=ADMISSION_MAX_WAITING,
+)
+print(f"[ADMISSION] Budget {ADMISSION.memory_budget / 1e6:.0f} MB in flight, {ADMISSION_MAX_PIXELS / 1e6:.0f} MP per image")
+
+# Admin-only on-demand profiling; nothing is hooked in unless ADMIN_TOKEN is set and a session is armed
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(MODEL_DIR, "profiles"))
+PROFILER = ProfilingTools(app, PROFILE_DIR) if ADMIN_TOKEN else None
+TORCH_TRACE = PROFILER.torch if PROFILER is not None else None
+
 print(f"Models loaded successfully!")
 print(f"Available pathologies: {PATHOLOGIES}")
 print(f"Mammography: Using DenseNet121 with breast-specific analysis")
 
+def image_to_tensor(img, target_size=224):
+    """Resize and normalize a decoded grayscale image into a model-ready tensor"""
+    img_tensor = torch.from_numpy(image_to_array(img, target_size))
+    return img_tensor.unsqueeze(0)  # Add batch dimension
+
 def process_image(image_data, target_size=224):
     """Process base64 or URL image to tensor"""
-    try:
-        if isinstance(image_data, str):
-            # Check if base64
-            if ',' in image_data:
-                # Remove data URL prefix
-                image_data = image_data.split(',')[1]
-            
-            # Decode base64
-            img_bytes = base64.b64decode(image_data)
-            img = Image.open(io.BytesIO(img_bytes)).convert('L')  # Grayscale
-        else:
-            img = Image.open(io.BytesIO(image_data)).convert('L')
-        
-        # Resize
-        img = img.resize((target_size, target_size), Image.Resampling.LANCZOS)
-        
-        # Convert to numpy array (0-255)
-        import numpy as np
-        img_np = np.array(img).astype(np.float32)
-        
-        # Scale to [0, 1] range
-        img_np = img_np / 255.0
-        
-        # Keep as 1 channel (xrv models expect 1 channel)
-        img_np = img_np.reshape(1, target_size, target_size)
-        
-        # Apply xrv normalization - use proper bound
-        # xrv expects values in [-1024, 1024] for real X-rays, but we'll use [0,1]
-        # with the proper xrv normalization
-        img_np = xrv.utils.normalize(img_np, maxval=1.0)
-        
-        # Convert to tensor
-        img_tensor = torch.from_numpy(img_np).float()
-        img_tensor = img_tensor.unsqueeze(0)  # Add batch dimension
-        
-        return img_tensor
-    except Exception as e:
-        raise ValueError(f"Failed to process image: {str(e)}")
+    return image_to_tensor(decode_image(image_data), target_size)
 
-def analyze_with_model(img_tensor, model_name='densenet121'):
-    """Run inference on the image - professional radiologist-friendly output"""
-    model = models[model_name]
-    
+def profiling_request():
+    """A cProfile'd request keeps its forward on its own thread, where the profiler can see it"""
+    return PROFILER is not None and PROFILER.endpoint.profiling_thread()
+
+def forward_with_embedding(model, img_tensor):
+    """Same forward pass as model(x), also returning the pooled penultimate-layer features"""
+    if TORCH_TRACE is not None and TORCH_TRACE.armed:
+        return TORCH_TRACE.capture(_forward_with_embedding, model, img_tensor)
+    return _forward_with_embedding(model, img_tensor)
+
+def _forward_with_embedding(model, img_tensor):
+    embedding = model.features2(img_tensor)
+    output = model.classifier(embedding)
+    if getattr(model, 'op_threshs', None) is not None:
+        output = torch.sigmoid(output)
+        output = xrv.models.op_norm(output, model.op_threshs)
+    elif getattr(model, 'apply_sigmoid', False):
+        output = torch.sigmoid(output)
+    return output, embedding
+
+def densenet_forward(img_tensor, model_name='densenet121'):
+    """(output, embedding) for a batch, through the shared batching queue when enabled"""
+    if model_name == 'densenet121' and DENSENET_BATCHER is not None and not profiling_request():
+        return DENSENET_BATCHER(img_tensor)
     with torch.no_grad():
-        output = model(img_tensor)
+        return forward_with_embedding(models[model_name], img_tensor)
+
+def analyze_with_model(img_tensor, model_name='densenet121', with_embedding=False):
+    """Run inference on the image - professional radiologist-friendly output"""
+    output, embedding = densenet_forward(img_tensor, model_name)
+    if not with_embedding:
+        embedding = None
     
     num_classes = output.shape[1]
     print(f"[DEBUG] Model output classes: {num_classes}")
     
     # Use raw sigmoid
     probs = torch.sigmoid(output).squeeze().numpy()
-    
-    xrv_pathologies = [
-        'Atelectasis', 'Consolidation', 'Infiltration', 'Pneumothorax', 'Edema',
-        'Emphysema', 'Fibrosis', 'Effusion', 'Pneumonia', 'Pleural_Thickening',
-        'Cardiomegaly', 'Lung Lesion', 'Fracture', 'Lung Opacity', 'Support Devices',
-        'Nodule', 'Mass', 'Hernia'
-    ]
-    
-    # Clinical significance mapping
-    clinical_significance = {
-        'Mass': {'category': 'Structural', 'urgency': 'high', 'location': 'Lung parenchyma', 'clinical': 'May indicate malignancy or benign tumor'},
-        'Nodule': {'category': 'Structural', 'urgency': 'high', 'location': 'Lung parenchyma', 'clinical': 'Requires follow-up, may be benign or malignant'},
-        'Lung Lesion': {'category': 'Structural', 'urgency': 'high', 'location': 'Lung parenchyma', 'clinical': 'Undefined lesion requiring further investigation'},
-        'Pneumonia': {'category': 'Infection', 'urgency': 'high', 'location': 'Lung fields', 'clinical': 'Infection requiring medical attention'},
-        'Pneumothorax': {'category': 'Emergency', 'urgency': 'critical', 'location': 'Pleural space', 'clinical': 'Emergency - immediate attention required'},
-        'Effusion': {'category': 'Fluid', 'urgency': 'medium', 'location': 'Pleural space', 'clinical': 'Fluid accumulation, may require thoracentesis'},
-        'Consolidation': {'category': 'Infection', 'urgency': 'medium', 'location': 'Lung fields', 'clinical': 'May indicate pneumonia or other infection'},
-        'Atelectasis': {'category': 'Collapse', 'urgency': 'medium', 'location': 'Lung fields', 'clinical': 'Lung collapse - may be postoperative or obstructive'},
-        'Cardiomegaly': {'category': 'Cardiac', 'urgency': 'medium', 'location': 'Mediastinum', 'clinical': 'Enlarged heart - cardiac evaluation recommended'},
-        'Edema': {'category': 'Fluid', 'urgency': 'high', 'location': 'Lung fields', 'clinical': 'Pulmonary edema - cardiac workup recommended'},
-        'Fibrosis': {'category': 'Chronic', 'urgency': 'low', 'location': 'Lung parenchyma', 'clinical': 'Chronic interstitial changes'},
-        'Emphysema': {'category': 'Chronic', 'urgency': 'low', 'location': 'Lung parenchyma', 'clinical': 'COPD-related changes'},
-        'Infiltration': {'category': 'Infection', 'urgency': 'medium', 'location': 'Lung fields', 'clinical': 'Possible infection or inflammation'},
-        'Pleural_Thickening': {'category': 'Structural', 'urgency': 'low', 'location': 'Pleura', 'clinical': 'Usually benign, may need monitoring'},
-        'Fracture': {'category': 'Trauma', 'urgency': 'medium', 'location': 'Ribs/osseous', 'clinical': 'Traumatic - pain management required'},
-        'Hernia': {'category': 'Structural', 'urgency': 'low', 'location': 'Diaphragm', 'clinical': 'Usually congenital or surgical'},
-        'Lung Opacity': {'category': 'General', 'urgency': 'medium', 'location': 'Lung fields', 'clinical': 'Non-specific opacity - further evaluation needed'},
-        'Support Devices': {'category': 'Iatrogenic', 'urgency': 'low', 'location': 'Various', 'clinical': 'Medical devices present - normal for patient'}
+    result = risk_assessment(probs, model_pathologies(model_name), model_name)
+    if embedding is not None:
+        result['embedding'] = embedding.squeeze(0).numpy()
+    return result
+
+def ensemble_analysis(img_tensor, with_embedding=False):
+    """Every ensemble member on the same tensor, averaged per pathology, then the usual risk logic"""
+    start = time.perf_counter()
+    if ENSEMBLE_PARALLEL:
+        futures = {name: batcher.submit(img_tensor) for name, batcher in ENSEMBLE_MEMBERS.items()}
+    else:
+        # Submitted one at a time in the result loop below, so only one member's forward runs per request
+        futures = dict.fromkeys(ENSEMBLE_MEMBERS)
+
+    # Members are averaged and labelled in the primary model's pathology order
+    target = model_pathologies('densenet121')
+    aligned = []
+    embedding = None
+    # Taken when each result is collected in submission order: an upper bound on when the member finished
+    member_ms = {}
+    for name, future in futures.items():
+        if future is None:
+            future = ENSEMBLE_MEMBERS[name].submit(img_tensor)
+        output, member_embedding = future.result()
+        member_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+        if name == 'densenet121':
+            embedding = member_embedding
+        probs = torch.sigmoid(output).squeeze(0).numpy()
+        aligned.append(align_probabilities(probs, model_pathologies(name), target))
+    aligned = np.stack(aligned)
+    forward_ms = (time.perf_counter() - start) * 1000
+
+    # Dataset-specific weights leave some pathologies out; each one is averaged over the members predicting it
+    result = risk_assessment(np.nanmean(aligned, axis=0), target, 'ensemble')
+    spread = np.nanmax(aligned, axis=0) - np.nanmin(aligned, axis=0)
+    with ENSEMBLE_LOCK:
+        single = sorted(ENSEMBLE_LATENCY['single'])
+    single_p50 = single[len(single) // 2] if single else None
+    result['ensemble'] = {
+        'members': [registry.source(name) for name in futures],
+        'member_ms': member_ms,
+        'forward_ms': round(forward_ms, 1),
+        'single_model_p50_ms': round(single_p50, 1) if single_p50 is not None else None,
+        'overhead_ms': round(forward_ms - single_p50, 1) if single_p50 is not None else None,
+        'max_disagreement': round(float(np.nanmax(spread)) * 100, 2),
     }
-    
+    if with_embedding and embedding is not None:
+        result['embedding'] = embedding.squeeze(0).numpy()
+    return result
+
+def ensemble_stats():
+    """Rolling single-model vs ensemble forward latency, for choosing the ensemble size"""
+    with ENSEMBLE_LOCK:
+        latency = {key: sorted(values) for key, values in ENSEMBLE_LATENCY.items()}
+    percentile = lambda values, q: round(values[min(len(values) - 1, int(q * len(values)))], 1) if values else None
+    stats = {
+        'members': [registry.source(name) for name in ENSEMBLE_MEMBERS],
+        'default': ENSEMBLE_DEFAULT,
+        'parallel': ENSEMBLE_PARALLEL,
+        'torch_threads_per_member': torch.get_num_threads(),
+        'cpus': usable_cpus(),
+    }
+    for key, values in latency.items():
+        stats[key] = {'requests': len(values), 'p50_ms': percentile(values, 0.5), 'p95_ms': percentile(values, 0.95)}
+    if latency['single'] and latency['ensemble']:
+        stats['overhead_p50_ms'] = round(stats['ensemble']['p50_ms'] - stats['single']['p50_ms'], 1)
+        stats['overhead_ratio'] = round(stats['ensemble']['p50_ms'] / stats['single']['p50_ms'], 2)
+    return stats
+
+def model_pathologies(model_name):
+    """Names of a chest model's outputs, in output order ('' where the weights have no such output)"""
+    return getattr(models[model_name], 'pathologies', XRV_PATHOLOGIES)
+
+def align_probabilities(probs, source_pathologies, target_pathologies):
+    """Reorder one model's outputs into another's pathology order; NaN where it has no such output"""
+    index = {name: i for i, name in enumerate(source_pathologies) if name}
+    return np.array([float(probs[index[name]]) if name in index else np.nan for name in target_pathologies])
+
+def risk_assessment(probs, pathologies, model_name='densenet121'):
+    """Findings, overall risk and recommendation from probabilities labelled by ``pathologies`` (NaN = not predicted)"""
     results = []
-    for i in range(min(len(probs), len(xrv_pathologies))):
-        prob = float(probs[i])
-        pathology = xrv_pathologies[i]
-        clin = clinical_significance.get(pathology, {'category': 'Other', 'urgency': 'low', 'location': 'Unknown', 'clinical': 'Finding requires clinical correlation'})
+    for pathology, prob in zip(pathologies, probs):
+        prob = float(prob)
+        if not pathology or np.isnan(prob):
+            continue
+        clin = CLINICAL_SIGNIFICANCE.get(pathology, {'category': 'Other', 'urgency': 'low', 'location': 'Unknown', 'clinical': 'Finding requires clinical correlation'})
         
         results.append({
             'pathology': pathology,
@@ -221,16 +562,9 @@ def analyze_with_model(img_tensor, model_name='densenet121'):
         risk_score = max(10, max_prob_raw * 0.4)
         recommendation = 'No significant abnormalities detected'
 
-    return {
+    result = {
         'model': model_name,
-        'model_info': {
-            'name': 'DenseNet121',
-            'architecture': '121-layer Dense Convolutional Network',
-            'training_data': 'NIH ChestX-ray14 + ChestNet',
-            'accuracy': '94.5%',
-            'auc': '0.89',
-            'f1_score': '0.87'
-        },
+        'model_info': DENSENET_MODEL_INFO,
         'overall_risk': overall_risk,
         'risk_score': round(risk_score, 1),
         'recommendation': recommendation,
@@ -246,73 +580,291 @@ def analyze_with_model(img_tensor, model_name='densenet121'):
             'medium_urgency': len(medium_urgency)
         }
     }
+    return result
+
+def assess_image_quality(img):
+    """Quality report for a single decoded grayscale image"""
+    if QUALITY_GATE == 'off':
+        return {"quality": "unchecked", "issues": []}
+    return assess_thumbnail_quality(make_thumbnail(img)[None])[0]
 
-def assess_image_quality(img_tensor):
-    """Basic image quality checks to guard against low-quality inputs."""
+def quality_rejection(quality):
+    """True when the quality gate is configured to stop poor images before inference"""
+    return QUALITY_GATE == 'reject' and quality.get("quality") == "poor"
+
+def admission_request(image_data, draft_size=None):
+    """Header-only look at an upload: enforce the pixel budget and estimate its peak memory.
+
+    Returns (raw_bytes, header, estimated_bytes); nothing has been decoded yet.
+    """
+    try:
+        raw = decode_payload(image_data)
+    except Exception as e:
+        raise ValueError(f"Failed to process image: {str(e)}")
+    header = read_image_header(raw)
+    ADMISSION.check_pixels(header)
+    pixels, decoded_bytes = decoded_size(header, draft_size)
+    gray_bytes = pixels if header['mode'] != 'L' else 0
+    # Request body plus the parsed base64 string, encoded bytes, decoded image and its grayscale copy
+    return raw, header, 2 * len(image_data) + len(raw) + decoded_bytes + gray_bytes
+
+def forward_bytes(images=1):
+    """Activation memory of a DenseNet forward pass over ``images`` 224x224 inputs"""
+    return int(images * ADMISSION_FORWARD_MB * 1e6)
+
+def densenet_stage_bytes(header, tiled=False):
+    """Working memory of the DenseNet mammography stage: one forward pass, or the tiled pipeline"""
+    return tiled_working_bytes(header) if tiled else forward_bytes()
+
+def tiled_working_bytes(header):
+    """uint8 image, tissue mask and int64 integral images of the downscaled mammogram, plus a tile batch"""
+    scale = min(1.0, MAMMO_TILE_MAX_SIDE / max(header['width'], header['height']))
+    return int(header['width'] * header['height'] * scale * scale * 26) + forward_bytes(MAMMO_TILE_BATCH)
+
+@contextlib.contextmanager
+def admitted(nbytes):
+    """Hold ``nbytes`` of the in-flight memory budget (waiting if needed) for the block"""
+    ticket = ADMISSION.acquire(nbytes)
+    g.admission = ticket
+    try:
+        yield ticket
+    finally:
+        ADMISSION.release(ticket)
+
+@contextlib.contextmanager
+def escalated(extra_bytes):
+    """Grow the request's reservation by ``extra_bytes`` for the block, then shrink it back"""
+    ticket = g.admission
+    held = ticket.nbytes
+    ADMISSION.resize(ticket, held + extra_bytes)
     try:
-        img = img_tensor.squeeze().numpy()
-        img = (img - img.min()) / (img.max() - img.min() + 1e-8)
-        mean_intensity = float(np.mean(img))
-        std_intensity = float(np.std(img))
-        # Blur estimate via Laplacian variance
-        lap = np.var(np.diff(img, axis=0)) + np.var(np.diff(img, axis=1))
-        blur_score = float(lap)
-
-        issues = []
-        if mean_intensity < 0.15 or mean_intensity > 0.85:
-            issues.append("exposure")
-        if std_intensity < 0.08:
-            issues.append("low_contrast")
-        if blur_score < 0.0005:
-            issues.append("blurry")
-
-        quality = "good" if len(issues) == 0 else "poor"
+        yield ticket
+    finally:
+        ADMISSION.resize(ticket, held)
+
+def admission_error_response(e):
+    response = jsonify({'success': False, 'error': str(e), 'admission_rejected': True})
+    response.status_code = e.status
+    if e.retry_after:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.before_request
+def reject_oversized_body():
+    if request.content_length is not None and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'success': False, 'error': f'Request body exceeds {MAX_REQUEST_MB:.0f} MB'}), 413
+
+@app.after_request
+def report_request_memory(response):
+    ticket = g.get('admission')
+    if ticket is not None:
+        report = ticket.report()
+        response.headers['X-Memory-Estimate-MB'] = str(report['estimate_mb'])
+        if report['peak_rss_mb'] is not None:
+            response.headers['X-Peak-RSS-MB'] = str(report['peak_rss_mb'])
+        print(f"[ADMISSION] {request.path}: estimate {report['estimate_mb']} MB, waited {report['waited_ms']} ms, "
+              f"RSS {report['rss_start_mb']} -> peak {report['peak_rss_mb']} MB")
+    return response
+
+@contextlib.contextmanager
+def preprocessed_chest_image(image_data):
+    """Yield (img_tensor, quality); img_tensor is None when the quality gate rejects the image.
+
+    With the preprocessing pool the tensor is a view on a shared-memory slot,
+    which stays reserved until the block exits.
+    """
+    if PREPROCESS_POOL is not None:
+        with PREPROCESS_POOL.preprocess(image_data, reject_poor=QUALITY_GATE == 'reject') as pre:
+            yield (torch.from_numpy(pre.array) if pre.array is not None else None), pre.quality
+        return
+
+    # Decode and gate on quality before the full-size tensor is built
+    img = decode_image(image_data, draft_size=(224, 224))
+    quality = assess_image_quality(img)
+    if quality_rejection(quality):
+        yield None, quality
+        return
+    yield image_to_tensor(img), quality
+
+def quality_rejection_response(quality):
+    return jsonify({
+        'success': False,
+        'rejected': True,
+        'error': 'Image quality too poor for reliable analysis: ' + ', '.join(quality.get('issues', [])),
+        'quality': quality
+    }), 422
+
+def wants_compact(data):
+    """Compact responses are opted into per request via ?format=compact or response_format: compact"""
+    fmt = request.args.get('format') or (data or {}).get('response_format')
+    return fmt == 'compact'
+
+def compact_analysis(result):
+    """Per-image verdict with probabilities as an array in /metadata's pathology order"""
+    by_name = {r['pathology']: r['probability'] for r in result['all_pathologies']}
+    return {
+        'probabilities': [by_name.get(p) for p in XRV_PATHOLOGIES],
+        'overall_risk': result['overall_risk'],
+        'risk_score': result['risk_score'],
+        'recommendation': result['recommendation'],
+        'has_abnormality': result['has_abnormality'],
+        'confidence': round(result['confidence'], 4),
+        'clinical_summary': result['clinical_summary'],
+        **({'ensemble': result['ensemble']} if 'ensemble' in result else {}),
+    }
+
+def compact_quality(quality):
+    return {'quality': quality['quality'], 'issues': quality['issues']}
+
+def map_mass_prob_to_birads(max_mass_prob):
+    """Map the DenseNet mass-likelihood score to a BI-RADS assessment"""
+    if max_mass_prob < 0.25:
         return {
-            "quality": quality,
-            "issues": issues,
-            "mean_intensity": round(mean_intensity, 3),
-            "std_intensity": round(std_intensity, 3),
-            "blur_score": round(blur_score, 6),
+            'birads': "BI-RADS 1",
+            'birads_score': 1,
+            'risk_level': "low",
+            'risk_score': round(max_mass_prob * 80, 1),
+            'finding': "No significant mass or abnormality detected",
+            'severity': "normal",
+            'recommendation': "Negative - continue annual screening",
         }
-    except Exception as e:
+    if max_mass_prob < 0.45:
+        return {
+            'birads': "BI-RADS 3",
+            'birads_score': 3,
+            'risk_level': "medium",
+            'risk_score': round(max_mass_prob * 80, 1),
+            'finding': "Probably benign finding - requires follow-up",
+            'severity': "watch",
+            'recommendation': "Probably benign - short-interval follow-up recommended (6 months)",
+        }
+    if max_mass_prob < 0.65:
         return {
-            "quality": "unknown",
-            "issues": ["quality_check_failed"],
-            "error": str(e),
+            'birads': "BI-RADS 4",
+            'birads_score': 4,
+            'risk_level': "high",
+            'risk_score': round(max_mass_prob * 100, 1),
+            'finding': "Suspicious abnormality - cannot exclude malignancy",
+            'severity': "suspicious",
+            'recommendation': "Suspicious abnormality - biopsy should be considered",
         }
+    return {
+        'birads': "BI-RADS 5",
+        'birads_score': 5,
+        'risk_level': "high",
+        'risk_score': round(max_mass_prob * 100, 1),
+        'finding': "Highly suspicious for malignancy",
+        'severity': "suspicious",
+        'recommendation': "Highly suggestive of malignancy - appropriate action required",
+    }
 
-def extract_mammo_features(image):
-    """Extract simple statistical features from mammography image"""
-    img = image.convert('L')
-    img = img.resize((100, 100))
-    arr = np.array(img)
+def tiled_mass_scores(image, tile_size=None, stride=None, batch_size=None,
+                      max_tiles=None, time_budget_ms=None):
+    """Score a full-resolution mammogram tile by tile with DenseNet.
 
-    features = []
-    features.append(np.mean(arr) / 255.0 * 30)
-    features.append(np.std(arr) / 255.0 * 30)
-    features.append(np.percentile(arr, 90) / 255.0 * 100)
-    features.append(np.sum(arr > 128) / arr.size * 1000)
+    Background tiles are skipped using a cheap intensity mask, the remaining
+    tissue tiles are ranked by tissue coverage and at most ``max_tiles`` of them
+    are pushed through the model in fixed-size batches. Scoring stops early once
+    ``time_budget_ms`` is spent so per-image latency stays bounded.
+    """
+    tile_size = tile_size or MAMMO_TILE_SIZE
+    stride = stride or MAMMO_TILE_STRIDE
+    batch_size = batch_size or MAMMO_TILE_BATCH
+    max_tiles = max_tiles or MAMMO_TILE_BUDGET
+    time_budget_ms = MAMMO_TILE_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms
+    start = time.perf_counter()
 
+    img = image.convert('L')
+    scale = min(1.0, MAMMO_TILE_MAX_SIDE / max(img.size))
+    if scale < 1.0:
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                         Image.Resampling.LANCZOS)
+    if img.width < tile_size or img.height < tile_size:
+        img = img.resize((max(img.width, tile_size), max(img.height, tile_size)),
+                         Image.Resampling.LANCZOS)
+    arr = np.asarray(img, dtype=np.uint8)
     h, w = arr.shape
-    for region in [
-        arr[:h//2, :w//2],
-        arr[:h//2, w//2:],
-        arr[h//2:, :w//2],
-        arr[h//2:, w//2:],
-        arr[h//3:2*h//3, w//3:2*w//3],
-    ]:
-        features.append(np.mean(region) / 255.0 * 30)
-        features.append(np.std(region) / 255.0 * 30)
-        features.append(np.percentile(region, 75) / 255.0 * 30)
-        features.append(np.percentile(region, 25) / 255.0 * 30)
-
-    edges = np.abs(np.diff(arr, axis=0)).mean() + np.abs(np.diff(arr, axis=1)).mean()
-    features.append(edges / 255.0 * 10)
-
-    while len(features) < 30:
-        features.append(features[len(features) % 10])
-
-    return features[:30]
+
+    # Tile origins, with a final row/column flush against the border
+    ys = list(range(0, h - tile_size + 1, stride))
+    xs = list(range(0, w - tile_size + 1, stride))
+    if ys[-1] != h - tile_size:
+        ys.append(h - tile_size)
+    if xs[-1] != w - tile_size:
+        xs.append(w - tile_size)
+    ys = np.array(ys)
+    xs = np.array(xs)
+
+    # Tissue coverage per tile from an integral image of the intensity mask
+    mask = arr > int(MAMMO_TILE_TISSUE_THRESHOLD * 255)
+    integral = np.pad(mask.cumsum(axis=0, dtype=np.int64).cumsum(axis=1), ((1, 0), (1, 0)))
+    y0 = ys[:, None]
+    x0 = xs[None, :]
+    y1 = y0 + tile_size
+    x1 = x0 + tile_size
+    coverage = (integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]) / float(tile_size * tile_size)
+
+    tissue = np.argwhere(coverage >= MAMMO_TILE_MIN_TISSUE)
+    if len(tissue) == 0:
+        # No tile passes the mask (very faint or cropped image) - score the densest tile
+        tissue = np.array([np.unravel_index(np.argmax(coverage), coverage.shape)])
+    order = np.argsort(-coverage[tissue[:, 0], tissue[:, 1]], kind='stable')
+    selected = tissue[order[:max_tiles]]
+
+    scores = []
+    positions = []
+    batches = 0
+    truncated = len(tissue) > max_tiles
+    model = models['densenet121']
+    for i in range(0, len(selected), batch_size):
+        if batches and time_budget_ms and (time.perf_counter() - start) * 1000 > time_budget_ms:
+            truncated = True
+            break
+        chunk = selected[i:i + batch_size]
+        tiles = np.stack([
+            arr[ys[r]:ys[r] + tile_size, xs[c]:xs[c] + tile_size] for r, c in chunk
+        ]).astype(np.float32) / 255.0
+        tiles = xrv.utils.normalize(tiles, maxval=1.0)
+        tensor = torch.from_numpy(tiles[:, None]).float()
+
+        with torch.no_grad():
+            if TORCH_TRACE is not None and TORCH_TRACE.armed:
+                output = TORCH_TRACE.capture(model, tensor)
+            else:
+                output = model(tensor)
+        probs = torch.sigmoid(output).numpy()
+        scores.extend(probs[:, MAMMO_MASS_INDICES].max(axis=1).tolist())
+        positions.extend((int(xs[c] / scale), int(ys[r] / scale)) for r, c in chunk)
+        batches += 1
+
+    scores = np.array(scores, dtype=np.float32)
+    top = np.argsort(-scores)[:5]
+    return {
+        'max_mass_prob': float(scores.max()),
+        'tiling': {
+            'tile_size': tile_size,
+            'stride': stride,
+            'scale': round(scale, 4),
+            'tiles_total': int(coverage.size),
+            'tiles_tissue': int(len(tissue)),
+            'tiles_scored': int(len(scores)),
+            'batches': batches,
+            'truncated': truncated,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+            'top_tiles': [
+                {'x': positions[i][0], 'y': positions[i][1], 'score': round(float(scores[i]), 4)}
+                for i in top
+            ],
+        },
+    }
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 until startup warmup has finished (unlike /health, which is liveness)"""
+    with WARMUP_LOCK:
+        state = dict(WARMUP_STATE, steps_ms=dict(WARMUP_STATE['steps_ms']), errors=dict(WARMUP_STATE['errors']))
+    status = 200 if state['status'] in ('ready', 'skipped') else 503
+    return jsonify(dict(state, ready=status == 200)), status
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -322,6 +874,209 @@ def health():
         'mammography': 'densenet121-breast-analysis'
     })
 
+def rf_mammo_probabilities(image):
+    """Run the RF feature model; returns (prediction, malignant_prob, benign_prob, pred_label)"""
+    start = time.perf_counter()
+    features = extract_mammo_features(image)
+    features_scaled = MAMMO_SCALER.transform([features])
+    prediction = MAMMO_MODEL.predict(features_scaled)[0]
+    probability = MAMMO_MODEL.predict_proba(features_scaled)[0]
+
+    class_names = MAMMO_CLASSES.get("names", ["malignant", "benign"]) if MAMMO_CLASSES else ["malignant", "benign"]
+    pred_label = class_names[prediction] if prediction < len(class_names) else "benign"
+    shadow_offer('mammography', lambda: features,
+                 {'malignant': float(probability[0]), 'benign': float(probability[1])},
+                 (time.perf_counter() - start) * 1000)
+    return prediction, float(probability[0]), float(probability[1]), pred_label
+
+def rf_mammography_result(rf_output, quality):
+    """Mammography response from an rf_mammo_probabilities result"""
+    prediction, malignant_prob, benign_prob, pred_label = rf_output
+    raw_confidence = max(malignant_prob, benign_prob)
+
+    # Map to BI-RADS
+    if prediction == 0:  # malignant
+        birads = "BI-RADS 4"
+        birads_score = 4
+        risk_level = "high"
+        risk_score = round(malignant_prob * 100, 1)
+        recommendation = "Suspicious abnormality - biopsy should be considered"
+    else:
+        if benign_prob > 0.85:
+            birads = "BI-RADS 2"
+            birads_score = 2
+            risk_level = "low"
+            risk_score = round((1 - benign_prob) * 20, 1)
+            recommendation = "Benign finding - routine screening recommended"
+        else:
+            birads = "BI-RADS 3"
+            birads_score = 3
+            risk_level = "medium"
+            risk_score = round((1 - benign_prob) * 40, 1)
+            recommendation = "Probably benign - short-interval follow-up recommended (6 months)"
+
+    return {
+        'success': True,
+        'prediction': pred_label,
+        'confidence': raw_confidence,
+        'calibratedConfidence': raw_confidence,
+        'riskScore': risk_score,
+        'quality': quality,
+        'probabilities': {
+            'benign': benign_prob,
+            'malignant': malignant_prob
+        },
+        'riskLevel': risk_level,
+        'birads': birads,
+        'birads_score': birads_score,
+        'analysisMethod': 'breast-cancer-rf-trained',
+        'findings': [
+            {
+                'type': 'Breast tissue',
+                'description': pred_label.capitalize(),
+                'probability': round(benign_prob * 100, 1),
+                'severity': 'normal' if pred_label == 'benign' else 'suspicious'
+            }
+        ],
+        'recommendation': recommendation,
+        'note': 'AI screening result. Please consult a radiologist for definitive diagnosis.'
+    }
+
+def densenet_mass_prob(image):
+    """Single 224x224 DenseNet pass; returns the max mass-like probability"""
+    img_tensor = image_to_tensor(image.convert('L'), target_size=224)
+
+    # Use simplified analysis for mammography
+    output, _ = densenet_forward(img_tensor)
+
+    probs = torch.sigmoid(output).squeeze().numpy()
+
+    # Look for mass-like patterns (relevant to breast)
+    mass_probs = probs[MAMMO_MASS_INDICES]
+    return float(max(mass_probs)) if len(mass_probs) else 0
+
+def densenet_mammography_result(image, quality, tiled=False):
+    """Mammography response from DenseNet, optionally tiled at full resolution"""
+    tiling = None
+    if tiled:
+        print("[MAMMOGRAPHY] Using tiled high-resolution breast tissue analysis")
+        scored = tiled_mass_scores(image)
+        max_mass_prob = scored['max_mass_prob']
+        tiling = scored['tiling']
+        print(f"[MAMMOGRAPHY] Tiled analysis: {tiling['tiles_scored']}/{tiling['tiles_total']} tiles in {tiling['elapsed_ms']}ms")
+    else:
+        print("[MAMMOGRAPHY] Using breast tissue analysis")
+        max_mass_prob = densenet_mass_prob(image)
+
+    # BI-RADS mapping based on findings
+    assessment = map_mass_prob_to_birads(max_mass_prob)
+    birads_score = assessment['birads_score']
+
+    result = {
+        'success': True,
+        'prediction': 'normal' if birads_score <= 2 else 'needs_review',
+        'confidence': round(max_mass_prob, 2),
+        'calibratedConfidence': round(max_mass_prob, 2),
+        'riskScore': assessment['risk_score'],
+        'quality': quality,
+        'probabilities': {
+            'normal': 1 - max_mass_prob,
+            'needs_review': max_mass_prob
+        },
+        'riskLevel': assessment['risk_level'],
+        'birads': assessment['birads'],
+        'birads_score': birads_score,
+        'analysisMethod': 'densenet121-breast-finetuned',
+        'model_info': {
+            'name': 'DenseNet121',
+            'pretraining': 'ImageNet',
+            'finetuning': 'CBIS-DDSM + INbreast mammography datasets',
+            'accuracy': '89.2%',
+            'sensitivity': '87.5%',
+            'specificity': '91.3%'
+        },
+        'findings': [
+            {
+                'type': 'Mass/Lesion',
+                'description': assessment['finding'],
+                'probability': round(max_mass_prob * 100, 1),
+                'severity': assessment['severity'],
+                'location': 'Breast tissue',
+                'characteristics': 'Need additional views for full assessment'
+            }
+        ],
+        'recommendation': assessment['recommendation'],
+        'note': 'AI-assisted screening. Mammography BI-RADS assessment should be confirmed by a qualified radiologist.'
+    }
+    if tiling:
+        result['analysisMethod'] = 'densenet121-breast-tiled'
+        result['tiling'] = tiling
+    return result
+
+def bounded_number(value, name, low, high, integer=False):
+    """A number from a request body, checked to lie in [low, high]; ValueError says what was wrong"""
+    kinds = int if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds) or not low <= value <= high:
+        raise ValueError(f"{name} must be {'an integer' if integer else 'a number'} between {low} and {high}")
+    return value
+
+def cascade_thresholds(value):
+    """Per-request cascade overrides, {'benign': p, 'malignant': p} with either key optional"""
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError("cascade_thresholds must be an object with 'benign' and/or 'malignant'")
+    return {
+        key: bounded_number(value[key], f"cascade_thresholds.{key}", 0.0, 1.0)
+        for key in ('benign', 'malignant') if value.get(key) is not None
+    }
+
+def cascade_exit(malignant_prob, benign_prob, benign_threshold=None, malignant_threshold=None):
+    """Return 'benign'/'malignant' when the RF stage is confident enough to answer, else None"""
+    benign_threshold = CASCADE_BENIGN_THRESHOLD if benign_threshold is None else benign_threshold
+    malignant_threshold = CASCADE_MALIGNANT_THRESHOLD if malignant_threshold is None else malignant_threshold
+    if benign_prob >= benign_threshold:
+        return 'benign'
+    if malignant_prob >= malignant_threshold:
+        return 'malignant'
+    return None
+
+def cascade_mammography_result(image, quality, benign_threshold=None, malignant_threshold=None):
+    """Cheap RF first; only uncertain cases pay for the DenseNet forward pass"""
+    benign_threshold = CASCADE_BENIGN_THRESHOLD if benign_threshold is None else float(benign_threshold)
+    malignant_threshold = CASCADE_MALIGNANT_THRESHOLD if malignant_threshold is None else float(malignant_threshold)
+    start = time.perf_counter()
+
+    rf_output = rf_mammo_probabilities(image)
+    _, malignant_prob, benign_prob, _ = rf_output
+    exit_label = cascade_exit(malignant_prob, benign_prob, benign_threshold, malignant_threshold)
+    rf_ms = (time.perf_counter() - start) * 1000
+
+    if exit_label:
+        result = rf_mammography_result(rf_output, quality)
+    else:
+        tiled = CASCADE_EXPENSIVE_MODE == 'tiled'
+        stage_bytes = densenet_stage_bytes({'width': image.width, 'height': image.height}, tiled=tiled)
+        with escalated(stage_bytes) if has_request_context() and g.get('admission') else contextlib.nullcontext():
+            result = densenet_mammography_result(image, quality, tiled=tiled)
+
+    with CASCADE_LOCK:
+        CASCADE_STATS['requests'] += 1
+        if exit_label:
+            CASCADE_STATS[f'rf_exit_{exit_label}'] += 1
+        else:
+            CASCADE_STATS['escalated'] += 1
+
+    result['cascade'] = {
+        'stage': 'rf' if exit_label else 'densenet',
+        'exit': exit_label,
+        'rf_probabilities': {'benign': benign_prob, 'malignant': malignant_prob},
+        'thresholds': {'benign': benign_threshold, 'malignant': malignant_threshold},
+        'rf_ms': round(rf_ms, 2),
+        'total_ms': round((time.perf_counter() - start) * 1000, 2),
+    }
+    return result
+
 @app.route('/mammography/analyze', methods=['POST'])
 def mammography_analyze():
     """Analyze mammography with realistic BI-RADS based reporting"""
@@ -331,171 +1086,64 @@ def mammography_analyze():
         if not data or 'image' not in data:
             return jsonify({'error': 'image (base64) required'}), 400
         
-        image_data = data['image']
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-
-        img_bytes = base64.b64decode(image_data)
-        img = Image.open(io.BytesIO(img_bytes))
-
-        quality_tensor = process_image(image_data, target_size=224)
-        quality = assess_image_quality(quality_tensor)
-
-        # Try sklearn RF model first (trained on breast cancer data)
-        if MAMMO_MODEL and MAMMO_SCALER:
-            print("[MAMMOGRAPHY] Processing with trained RF model")
-            features = extract_mammo_features(img)
-            features_scaled = MAMMO_SCALER.transform([features])
-            prediction = MAMMO_MODEL.predict(features_scaled)[0]
-            probability = MAMMO_MODEL.predict_proba(features_scaled)[0]
-            
-            class_names = MAMMO_CLASSES.get("names", ["malignant", "benign"]) if MAMMO_CLASSES else ["malignant", "benign"]
-            pred_label = class_names[prediction] if prediction < len(class_names) else "benign"
-
-            raw_confidence = float(max(probability))
-            malignant_prob = float(probability[0])
-            benign_prob = float(probability[1])
-            
-            # Map to BI-RADS
-            if prediction == 0:  # malignant
-                birads = "BI-RADS 4"
-                birads_score = 4
-                risk_level = "high"
-                risk_score = round(malignant_prob * 100, 1)
-                recommendation = "Suspicious abnormality - biopsy should be considered"
-            else:
-                if benign_prob > 0.85:
-                    birads = "BI-RADS 2"
-                    birads_score = 2
-                    risk_level = "low"
-                    risk_score = round((1 - benign_prob) * 20, 1)
-                    recommendation = "Benign finding - routine screening recommended"
-                else:
-                    birads = "BI-RADS 3"
-                    birads_score = 3
-                    risk_level = "medium"
-                    risk_score = round((1 - benign_prob) * 40, 1)
-                    recommendation = "Probably benign - short-interval follow-up recommended (6 months)"
-
-            return jsonify({
-                'success': True,
-                'prediction': pred_label,
-                'confidence': raw_confidence,
-                'calibratedConfidence': raw_confidence,
-                'riskScore': risk_score,
-                'quality': quality,
-                'probabilities': {
-                    'benign': benign_prob,
-                    'malignant': malignant_prob
-                },
-                'riskLevel': risk_level,
-                'birads': birads,
-                'birads_score': birads_score,
-                'analysisMethod': 'breast-cancer-rf-trained',
-                'findings': [
-                    {
-                        'type': 'Breast tissue',
-                        'description': pred_label.capitalize(),
-                        'probability': round(benign_prob * 100, 1),
-                        'severity': 'normal' if pred_label == 'benign' else 'suspicious'
-                    }
-                ],
-                'recommendation': recommendation,
-                'note': 'AI screening result. Please consult a radiologist for definitive diagnosis.'
-            })
-
-        # Fallback: analyze with DenseNet but present as mammography
-        print("[MAMMOGRAPHY] Using breast tissue analysis")
-        img_tensor = process_image(image_data, target_size=224)
-        
-        # Use simplified analysis for mammography
-        with torch.no_grad():
-            output = models['densenet121'](img_tensor)
-        
-        probs = torch.sigmoid(output).squeeze().numpy()
-        
-        # Look for mass-like patterns (relevant to breast)
-        mass_related = ['Mass', 'Nodule', 'Lung Lesion', 'Consolidation']
-        mass_probs = [probs[15], probs[14], probs[11], probs[1]]  # indices for these in xrv
-        
-        max_mass_prob = max(mass_probs) if mass_probs else 0
-        
-        # BI-RADS mapping based on findings
-        if max_mass_prob < 0.25:
-            birads = "BI-RADS 1"
-            birads_score = 1
-            risk_level = "low"
-            risk_score = round(max_mass_prob * 80, 1)
-            finding = "No significant mass or abnormality detected"
-            severity = "normal"
-            recommendation = "Negative - continue annual screening"
-        elif max_mass_prob < 0.45:
-            birads = "BI-RADS 3"
-            birads_score = 3
-            risk_level = "medium"
-            risk_score = round(max_mass_prob * 80, 1)
-            finding = "Probably benign finding - requires follow-up"
-            severity = "watch"
-            recommendation = "Probably benign - short-interval follow-up recommended (6 months)"
-        elif max_mass_prob < 0.65:
-            birads = "BI-RADS 4"
-            birads_score = 4
-            risk_level = "high"
-            risk_score = round(max_mass_prob * 100, 1)
-            finding = "Suspicious abnormality - cannot exclude malignancy"
-            severity = "suspicious"
-            recommendation = "Suspicious abnormality - biopsy should be considered"
-        else:
-            birads = "BI-RADS 5"
-            birads_score = 5
-            risk_level = "high"
-            risk_score = round(max_mass_prob * 100, 1)
-            finding = "Highly suspicious for malignancy"
-            severity = "suspicious"
-            recommendation = "Highly suggestive of malignancy - appropriate action required"
-
-        return jsonify({
-            'success': True,
-            'prediction': 'normal' if birads_score <= 2 else 'needs_review',
-            'confidence': round(max_mass_prob, 2),
-            'calibratedConfidence': round(max_mass_prob, 2),
-            'riskScore': risk_score,
-            'quality': quality,
-            'probabilities': {
-                'normal': 1 - max_mass_prob,
-                'needs_review': max_mass_prob
-            },
-            'riskLevel': risk_level,
-            'birads': birads,
-            'birads_score': birads_score,
-            'analysisMethod': 'densenet121-breast-finetuned',
-            'model_info': {
-                'name': 'DenseNet121',
-                'pretraining': 'ImageNet',
-                'finetuning': 'CBIS-DDSM + INbreast mammography datasets',
-                'accuracy': '89.2%',
-                'sensitivity': '87.5%',
-                'specificity': '91.3%'
-            },
-            'findings': [
-                {
-                    'type': 'Mass/Lesion',
-                    'description': finding,
-                    'probability': round(max_mass_prob * 100, 1),
-                    'severity': severity,
-                    'location': 'Breast tissue',
-                    'characteristics': 'Need additional views for full assessment'
-                }
-            ],
-            'recommendation': recommendation,
-            'note': 'AI-assisted screening. Mammography BI-RADS assessment should be confirmed by a qualified radiologist.'
-        })
+        mode = data.get('mode') or MAMMO_MODE
+        try:
+            thresholds = cascade_thresholds(data.get('cascade_thresholds'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        raw, header, nbytes = admission_request(data['image'])
+        # Reserve for the path that will run: with the RF loaded, rf/auto/cascade answer from it
+        # (a cascade escalation reserves its DenseNet stage only when it escalates)
+        if MAMMO_MODEL is None or MAMMO_SCALER is None or mode not in ('rf', 'auto', 'cascade'):
+            nbytes += densenet_stage_bytes(header, tiled=mode == 'tiled')
+        with admitted(nbytes):
+            return mammography_analysis(decode_image(raw), mode, thresholds)
+    except AdmissionError as e:
+        print(f"[MAMMOGRAPHY] Not admitted: {e}")
+        return admission_error_response(e)
     except Exception as e:
         import traceback
         print(f"[MAMMOGRAPHY ERROR] {str(e)}")
         print(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def mammography_analysis(img, mode, thresholds):
+    """Quality gate and mode dispatch for /mammography/analyze on a decoded image"""
+    quality = assess_image_quality(img)
+    if quality_rejection(quality):
+        print(f"[MAMMOGRAPHY] Rejected low quality image: {quality}")
+        return quality_rejection_response(quality)
+
+    rf_available = MAMMO_MODEL is not None and MAMMO_SCALER is not None
+
+    if mode == 'cascade' and rf_available:
+        result = cascade_mammography_result(
+            img, quality,
+            benign_threshold=thresholds.get('benign'),
+            malignant_threshold=thresholds.get('malignant'),
+        )
+        print(f"[MAMMOGRAPHY] Cascade answered at stage: {result['cascade']['stage']}")
+        return jsonify(result)
+
+    # Try sklearn RF model first (trained on breast cancer data)
+    if rf_available and mode in ('auto', 'rf'):
+        print("[MAMMOGRAPHY] Processing with trained RF model")
+        return jsonify(rf_mammography_result(rf_mammo_probabilities(img), quality))
+
+    # Fallback: analyze with DenseNet but present as mammography
+    return jsonify(densenet_mammography_result(img, quality, tiled=mode == 'tiled'))
+
+@app.route('/mammography/cascade/stats', methods=['GET'])
+def mammography_cascade_stats():
+    """Live counters for the RF -> DenseNet cascade"""
+    with CASCADE_LOCK:
+        stats = dict(CASCADE_STATS)
+    stats['skip_fraction'] = round(
+        (stats['rf_exit_benign'] + stats['rf_exit_malignant']) / stats['requests'], 4
+    ) if stats['requests'] else None
+    stats['thresholds'] = {'benign': CASCADE_BENIGN_THRESHOLD, 'malignant': CASCADE_MALIGNANT_THRESHOLD}
+    return jsonify(stats)
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """Analyze chest X-ray image"""
@@ -511,42 +1159,75 @@ def analyze():
         
         print(f"[CHEST X-RAY] Processing image...")
         
-        # Process image
-        img_tensor = process_image(image_data)
-        print(f"[CHEST X-RAY] Image processed, running model...")
+        return_embedding = bool(data.get('return_embedding'))
+        persist_embedding = bool(data.get('persist_embedding')) and data.get('patient_id') is not None
+        use_ensemble = bool(data.get('ensemble', ENSEMBLE_DEFAULT)) and bool(ENSEMBLE_MEMBERS)
+        forwards = len(ENSEMBLE_MEMBERS) if use_ensemble else 1
 
-        quality = assess_image_quality(img_tensor)
-        if quality["quality"] == "poor":
-            print(f"[CHEST X-RAY] Low quality image detected: {quality}")
-        
-        # Run analysis
-        results = analyze_with_model(img_tensor)
-        
-        print(f"[CHEST X-RAY] Result: {results}")
+        # Header-only admission, then process image (quality is gated before the full-size tensor is built)
+        raw, _, nbytes = admission_request(image_data, draft_size=(224, 224))
+        with admitted(nbytes + forward_bytes(forwards)), preprocessed_chest_image(raw) as (img_tensor, quality):
+            if quality["quality"] == "poor":
+                print(f"[CHEST X-RAY] Low quality image detected: {quality}")
+            if img_tensor is None:
+                return quality_rejection_response(quality)
+            print(f"[CHEST X-RAY] Image processed, running model...")
+
+            # Run analysis
+            start = time.perf_counter()
+            if use_ensemble:
+                # One preprocessed tensor shared by every member
+                results = ensemble_analysis(img_tensor, with_embedding=return_embedding or persist_embedding)
+            else:
+                results = analyze_with_model(img_tensor, with_embedding=return_embedding or persist_embedding)
+            if ENSEMBLE_MEMBERS:
+                with ENSEMBLE_LOCK:
+                    ENSEMBLE_LATENCY['ensemble' if use_ensemble else 'single'].append((time.perf_counter() - start) * 1000)
+            # The pool's shared-memory tensor is released with this block, so the shadow gets a copy
+            shadow_offer('chest', img_tensor.clone, results, (time.perf_counter() - start) * 1000)
+        embedding = results.pop('embedding', None)
         
-        # Add chest X-ray specific model info
-        results['model_info'] = {
-            'name': 'DenseNet121',
-            'architecture': '121-layer Dense Convolutional Network',
-            'pretraining': 'ImageNet',
-            'finetuning': 'NIH ChestX-ray14 + CheXpert',
-            'primary_use': 'Chest radiograph interpretation',
-            'performance': {
-                'accuracy': '94.5%',
-                'auc_roc': '0.89',
-                'sensitivity': '0.85',
-                'specificity': '0.92'
-            },
-            'limitations': 'Model may have reduced sensitivity for subtle findings. Clinical correlation recommended.'
-        }
+        print(f"[CHEST X-RAY] Result: risk={results['overall_risk']} score={results['risk_score']}")
         
-        return jsonify({
-            'success': True,
-            'analysis': results,
-            'quality': quality,
-            'disclaimer': 'This is an AI-assisted screening tool, not a medical diagnosis. Consult a healthcare professional for medical advice.'
-        })
+        if wants_compact(data):
+            # Static text and model info are served once by /metadata
+            response = {
+                'success': True,
+                'metadata_version': METADATA_VERSION,
+                'analysis': compact_analysis(results),
+                'quality': compact_quality(quality),
+            }
+        else:
+            # Add chest X-ray specific model info
+            results['model_info'] = CHEST_XRAY_MODEL_INFO
+            
+            response = {
+                'success': True,
+                'analysis': results,
+                'quality': quality,
+                'disclaimer': CHEST_XRAY_DISCLAIMER
+            }
+        if embedding is not None:
+            if return_embedding:
+                response['embedding'] = [round(float(v), 6) for v in embedding]
+            if persist_embedding:
+                try:
+                    response['embedding_id'] = EMBEDDINGS.add(
+                        embedding,
+                        patient_id=data['patient_id'],
+                        study_id=data.get('study_id'),
+                        study_date=data.get('study_date'),
+                        risk_score=results['risk_score'],
+                        model='densenet121',
+                    )
+                    print(f"[EMBEDDINGS] Stored study for patient {data['patient_id']} as row {response['embedding_id']}")
+                except ValueError as e:
+                    response['embedding_error'] = str(e)
+        return jsonify(response)
         
+    except AdmissionError as e:
+        print(f"[CHEST X-RAY] Not admitted: {e}")
+        return admission_error_response(e)
     except Exception as e:
         import traceback
         print(f"[CHEST X-RAY ERROR] Analyze failed: {str(e)}")
@@ -556,33 +1237,571 @@ def analyze():
             'error': str(e)
         }), 500
 
+@app.route('/embeddings/patient/<patient_id>', methods=['GET'])
+def embeddings_patient(patient_id):
+    """Longitudinal view: every indexed study of a patient, compared to baseline and previous"""
+    studies = EMBEDDINGS.patient_history(patient_id)
+    return jsonify({'success': True, 'patient_id': patient_id, 'studies': studies})
+
+@app.route('/embeddings/search', methods=['POST'])
+def embeddings_search():
+    """Cosine nearest neighbours for an embedding or an already indexed study"""
+    data = request.get_json() or {}
+    try:
+        k = bounded_number(data.get('k', 5), 'k', 1, EMBEDDING_SEARCH_MAX_K, integer=True)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    exclude_row = None
+    if data.get('study_id'):
+        exclude_row = EMBEDDINGS.row_for_study(data['study_id'])
+        if exclude_row is None:
+            return jsonify({'success': False, 'error': f"Unknown study_id {data['study_id']}"}), 404
+        embedding, _ = EMBEDDINGS.get(exclude_row)
+    elif data.get('embedding'):
+        embedding = data['embedding']
+    else:
+        return jsonify({'success': False, 'error': 'embedding or study_id required'}), 400
+
+    try:
+        neighbours = EMBEDDINGS.search(embedding, k=k, patient_id=data.get('patient_id'), exclude_row=exclude_row)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'results': neighbours})
+
 @app.route('/batch', methods=['POST'])
 def batch_analyze():
     """Analyze multiple images"""
     try:
         data = request.get_json()
         images = data.get('images', [])
+        compact = wants_compact(data)
+
+        def entry(analysis, quality):
+            if compact:
+                analysis = compact_analysis(analysis)
+                if quality:
+                    analysis['quality'] = compact_quality(quality)
+            elif quality:
+                analysis['quality'] = quality
+            return analysis
+
+        def batch_response(results):
+            response = {'success': True, 'results': results}
+            if compact:
+                response['metadata_version'] = METADATA_VERSION
+            return jsonify(response)
         
-        results = []
-        for img in images:
+        # Headers only: every image must fit the pixel budget, then the batch reserves memory once
+        prepared = []
+        nbytes = 0
+        for image_data in images:
             try:
-                img_tensor = process_image(img)
-                analysis = analyze_with_model(img_tensor)
-                results.append(analysis)
-            except Exception as e:
-                results.append({'error': str(e)})
-        
-        return jsonify({
-            'success': True,
-            'results': results
-        })
-        
+                raw, _, image_bytes = admission_request(image_data, draft_size=(224, 224))
+                prepared.append(raw)
+                nbytes += image_bytes
+            except (AdmissionError, ValueError) as e:
+                prepared.append(e)
+
+        # Images go through the model one at a time
+        with admitted(nbytes + forward_bytes()):
+            return batch_results(prepared, entry, batch_response)
+
+    except AdmissionError as e:
+        return admission_error_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def batch_results(prepared, entry, batch_response):
+    """/batch over header-checked raw images (or the exception that rejected each one)"""
+    if PREPROCESS_POOL is not None:
+        # Workers decode, gate and normalize in parallel; tensors stay in shared memory
+        results = []
+        pooled = PREPROCESS_POOL.imap([raw for raw in prepared if not isinstance(raw, Exception)],
+                                      reject_poor=QUALITY_GATE == 'reject')
+        for raw in prepared:
+            item = raw if isinstance(raw, Exception) else next(pooled)
+            if isinstance(item, Exception):
+                results.append({'error': str(item)})
+                continue
+            with item:
+                if item.array is None:
+                    results.append({'error': 'Image quality too poor for reliable analysis', 'rejected': True, 'quality': item.quality})
+                    continue
+                try:
+                    analysis = analyze_with_model(torch.from_numpy(item.array))
+                    results.append(entry(analysis, item.quality))
+                except Exception as e:
+                    results.append({'error': str(e)})
+        return batch_response(results)
+
+    # Decode everything first so the quality gate runs once, vectorized, over the batch
+    decoded = []
+    for raw in prepared:
+        try:
+            decoded.append(raw if isinstance(raw, Exception) else decode_image(raw, draft_size=(224, 224)))
+        except Exception as e:
+            decoded.append(e)
+
+    valid = [i for i, img in enumerate(decoded) if not isinstance(img, Exception)]
+    qualities = {}
+    if valid and QUALITY_GATE != 'off':
+        thumbnails = np.stack([make_thumbnail(decoded[i]) for i in valid])
+        qualities = dict(zip(valid, assess_thumbnail_quality(thumbnails)))
+
+    results = []
+    for i, img in enumerate(decoded):
+        if isinstance(img, Exception):
+            results.append({'error': str(img)})
+            continue
+        quality = qualities.get(i)
+        if quality and quality_rejection(quality):
+            results.append({'error': 'Image quality too poor for reliable analysis', 'rejected': True, 'quality': quality})
+            continue
+        try:
+            img_tensor = image_to_tensor(img)
+            analysis = analyze_with_model(img_tensor)
+            results.append(entry(analysis, quality))
+        except Exception as e:
+            results.append({'error': str(e)})
+    
+    return batch_response(results)
+
+def predict_breast_cancer(features):
+    """Predict breast cancer from 30 features"""
+    if not BREAST_MODEL_AVAILABLE:
+        raise RuntimeError("Model unavailable - verify numpy/joblib compatibility and model files.")
+    if len(features) != 30:
+        raise ValueError(f"Expected 30 features, got {len(features)}")
+    
+    features_array = np.array(features).reshape(1, -1)
+    features_scaled = BREAST_SCALER.transform(features_array)
+    prediction = BREAST_MODEL.predict(features_scaled)[0]
+    probability = BREAST_MODEL.predict_proba(features_scaled)[0]
+    
+    return {
+        "prediction": "malignant" if prediction == 1 else "benign",
+        "confidence": float(max(probability)),
+        "probabilities": {
+            "benign": float(probability[0]),
+            "malignant": float(probability[1])
+        },
+        "riskLevel": "high" if prediction == 1 else "low"
+    }
+
+@app.route('/breast-cancer/health', methods=['GET'])
+@app.route('/breast-service/health', methods=['GET'])
+def breast_cancer_health():
+    return jsonify({"status": "healthy", "model": "breast-cancer-rf", "modelAvailable": BREAST_MODEL_AVAILABLE})
+
+@app.route('/breast-cancer/predict', methods=['POST'])
+@app.route('/breast-service/predict', methods=['POST'])
+@app.route('/predict', methods=['POST'])
+def breast_cancer_predict():
+    data = request.get_json()
+    
+    if not data or "features" not in data:
+        return jsonify({"error": "features array required"}), 400
+    
+    try:
+        if not BREAST_MODEL_AVAILABLE:
+            return jsonify({"error": "Model unavailable on this instance"}), 503
+        return jsonify(predict_breast_cancer(data["features"]))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/breast-cancer/predict-from-image', methods=['POST'])
+@app.route('/breast-service/predict-from-image', methods=['POST'])
+@app.route('/predict-from-image', methods=['POST'])
+def breast_cancer_predict_from_image():
+    """Extract features from image and predict"""
+    data = request.get_json()
+    
+    if not data or "imageBase64" not in data:
+        return jsonify({"error": "imageBase64 required"}), 400
+    
+    return jsonify({
+        "message": "Image feature extraction not implemented - use /predict with extracted features",
+        "featuresNeeded": BREAST_FEATURE_NAMES
+    })
+
+@app.route('/mammography-service/health', methods=['GET'])
+def mammography_service_health():
+    return jsonify({"status": "healthy", "model": "mammography-analyzer"})
+
+@app.route('/mammography/statistical', methods=['POST'])
+@app.route('/mammography-service/analyze', methods=['POST'])
+def mammography_statistical():
+    """Statistical-feature RF screening (formerly mammography-service.py /analyze)"""
+    data = request.get_json()
+    
+    if not data or "image" not in data:
+        return jsonify({"error": "image (base64) required"}), 400
+    
+    try:
+        if not BREAST_MODEL_AVAILABLE:
+            return jsonify({"error": "Model unavailable on this instance"}), 503
+        raw, _, nbytes = admission_request(data["image"])
+        with admitted(nbytes):
+            features = extract_mammo_features(decode_image(raw))
+        features_scaled = BREAST_SCALER.transform([features])
+        
+        prediction = BREAST_MODEL.predict(features_scaled)[0]
+        probability = BREAST_MODEL.predict_proba(features_scaled)[0]
+        
+        return jsonify({
+            "prediction": "malignant" if prediction == 1 else "benign",
+            "confidence": float(max(probability)),
+            "probabilities": {
+                "benign": float(probability[0]),
+                "malignant": float(probability[1])
+            },
+            "riskLevel": "high" if prediction == 1 else "low",
+            "analysisMethod": "statistical-features",
+            "note": "This is a preliminary screening. Please consult a radiologist for proper diagnosis."
+        })
+    except AdmissionError as e:
+        return admission_error_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """Memory budget, in-flight reservations, queue and rejection counters, RSS"""
+    return jsonify(ADMISSION.stats())
+
+@app.route('/metadata', methods=['GET'])
+def metadata():
+    """Static analysis metadata referenced by compact responses, cacheable per version"""
+    response = jsonify({'version': METADATA_VERSION, **METADATA})
+    response.set_etag(METADATA_VERSION)
+    response.cache_control.public = True
+    response.cache_control.max_age = METADATA_MAX_AGE
+    return response.make_conditional(request)
+
+@app.route('/models', methods=['GET'])
+def models_info():
+    """Models held by this process (shared files counted once), batching queue stats and tuning"""
+    info = registry.summary()
+    info['batching'] = DENSENET_BATCHER.stats() if DENSENET_BATCHER is not None else None
+    info['ensemble'] = ensemble_stats() if ENSEMBLE_MEMBERS else None
+    info['tuning'] = {
+        'profile': AUTOTUNE_PROFILE if TUNING is not None else None,
+        'torch_threads': torch.get_num_threads(),
+        'batch_max_size': BATCH_MAX_SIZE,
+        'channels_last': bool(TUNING and TUNING.get('channels_last')),
+    }
+    return jsonify(info)
+
+def admin_required(view):
+    """Admin routes exist only when ADMIN_TOKEN is set and need it as X-Admin-Token or a Bearer token"""
+    @functools.wraps(view)
+    def check(*args, **kwargs):
+        if PROFILER is None:
+            return jsonify({'error': 'Not found'}), 404
+        token = request.headers.get('X-Admin-Token', '')
+        auth = request.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            token = auth[len('Bearer '):]
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return check
+
+@app.route('/admin/profile', methods=['GET'])
+@admin_required
+def admin_profile_status():
+    """Running profiling sessions and the result files available for download"""
+    return jsonify(PROFILER.status())
+
+@app.route('/admin/profile/stacks', methods=['POST'])
+@admin_required
+def admin_profile_stacks():
+    """Sample every thread's Python stack for ``seconds`` into a folded-stacks file"""
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = bounded_number(data.get('seconds', 10), 'seconds', 1, 300)
+        interval_ms = bounded_number(data.get('interval_ms', 10), 'interval_ms', 1, 1000)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        return jsonify({'success': True, 'session': PROFILER.stacks.start(seconds, interval_ms)})
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+
+@app.route('/admin/profile/torch', methods=['POST'])
+@admin_required
+def admin_profile_torch():
+    """torch.profiler trace of the next ``passes`` DenseNet forward passes"""
+    data = request.get_json(silent=True) or {}
+    try:
+        passes = bounded_number(data.get('passes', 5), 'passes', 1, 100, integer=True)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        return jsonify({'success': True, 'session': PROFILER.torch.arm(passes)})
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+
+@app.route('/admin/profile/endpoint', methods=['GET', 'POST', 'DELETE'])
+@admin_required
+def admin_profile_endpoint():
+    """cProfile aggregates for one endpoint: POST starts, GET reports so far, DELETE stops and writes"""
+    if request.method == 'GET':
+        return jsonify({'session': PROFILER.endpoint.current, 'report': PROFILER.endpoint.report()})
+    if request.method == 'DELETE':
+        return jsonify({'success': True, 'session': PROFILER.endpoint.stop()})
+
+    data = request.get_json(silent=True) or {}
+    endpoint = data.get('endpoint')
+    if not endpoint or endpoint.startswith('admin_'):
+        return jsonify({'success': False, 'error': 'endpoint required (Flask endpoint name, e.g. "analyze")'}), 400
+    try:
+        requests = bounded_number(data.get('requests', 20), 'requests', 1, 1000, integer=True)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        session = PROFILER.endpoint.start(endpoint, requests)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    return jsonify({'success': True, 'session': session})
+
+@app.route('/admin/profile/files/<path:name>', methods=['GET'])
+@admin_required
+def admin_profile_file(name):
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
+def mount_legacy_prefix(prefix):
+    """Serve the gateway's ``<prefix>/...`` compatibility routes at a retired service's bare paths"""
+    wsgi_app = app.wsgi_app
+
+    def legacy_paths(environ, start_response):
+        environ['PATH_INFO'] = prefix + environ.get('PATH_INFO', '')
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = legacy_paths
+
+# Shadow evaluation: a sampled fraction of live inputs is mirrored, after the response has been
+# sent, to candidate models on one low-priority thread capped at SHADOW_CPU_FRACTION of the CPUs.
+# Candidates: SHADOW_CHEST_WEIGHTS (xrv DenseNet weights, e.g. densenet121-res224-chex) for /analyze,
+# SHADOW_MAMMO_RF_MODEL + SHADOW_MAMMO_RF_SCALER (joblib files, same class order as the primary RF)
+# for every mammography RF prediction. Comparisons go to SHADOW_LOG as JSON lines.
+SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE', '0.05'))
+SHADOW_CHEST_WEIGHTS = os.environ.get('SHADOW_CHEST_WEIGHTS', '')
+SHADOW_MAMMO_RF_MODEL = os.environ.get('SHADOW_MAMMO_RF_MODEL', '')
+SHADOW_MAMMO_RF_SCALER = os.environ.get('SHADOW_MAMMO_RF_SCALER', '')
+SHADOW_QUEUE_SIZE = int(os.environ.get('SHADOW_QUEUE_SIZE', '16'))
+SHADOW_CPU_FRACTION = float(os.environ.get('SHADOW_CPU_FRACTION', '0.25'))
+SHADOW_LOG = os.environ.get('SHADOW_LOG', os.path.join(MODEL_DIR, "shadow", "shadow_log.jsonl"))
+SHADOW = None
+
+def shadow_offer(kind, make_inputs, primary, primary_ms):
+    """Mirror a sampled request to the shadow candidate once its response has been sent"""
+    if SHADOW is None or not has_request_context() or not SHADOW.sample(kind):
+        return
+    inputs = make_inputs()
+
+    @after_this_request
+    def submit_after_response(response):
+        response.call_on_close(lambda: SHADOW.submit(kind, inputs, primary, primary_ms))
+        return response
+
+def shadow_chest_run(img_tensor):
+    model = models['shadow_densenet']
+    with torch.no_grad():
+        output, _ = _forward_with_embedding(model, img_tensor)
+    probs = torch.sigmoid(output).squeeze(0).numpy()
+    # Labelled in the primary's order so compare_chest matches findings by the same names
+    primary_pathologies = model_pathologies('densenet121')
+    return risk_assessment(align_probabilities(probs, model.pathologies, primary_pathologies), primary_pathologies,
+                           'shadow_densenet')
+
+def compare_chest(primary, shadow):
+    primary_probs = {r['pathology']: r['probability'] for r in primary['all_pathologies']}
+    shadow_probs = {r['pathology']: r['probability'] for r in shadow['all_pathologies']}
+    diffs = [abs(primary_probs[name] - prob) for name, prob in shadow_probs.items() if name in primary_probs]
+    top = lambda result: result['all_pathologies'][0]['pathology'] if result['all_pathologies'] else None
+    return {
+        'agree': primary['overall_risk'] == shadow['overall_risk'],
+        'top_agree': top(primary) == top(shadow),
+        'mean_abs_diff': round(sum(diffs) / len(diffs), 2) if diffs else None,
+        'max_abs_diff': round(max(diffs), 2) if diffs else None,
+        'primary': {'risk': primary['overall_risk'], 'score': primary['risk_score'], 'top': top(primary)},
+        'shadow': {'risk': shadow['overall_risk'], 'score': shadow['risk_score'], 'top': top(shadow)},
+    }
+
+def shadow_mammography_run(features):
+    scaled = registry['shadow_mammography_scaler'].transform([features])
+    probability = registry['shadow_mammography_rf'].predict_proba(scaled)[0]
+    return {'malignant': float(probability[0]), 'benign': float(probability[1])}
+
+def compare_mammography(primary, shadow):
+    label = lambda probs: 'malignant' if probs['malignant'] > probs['benign'] else 'benign'
+    exit_stage = lambda probs: cascade_exit(probs['malignant'], probs['benign'])
+    return {
+        'agree': label(primary) == label(shadow),
+        'malignant_diff': round(shadow['malignant'] - primary['malignant'], 4),
+        'cascade_exit_agree': exit_stage(primary) == exit_stage(shadow),
+        'primary': {'label': label(primary), 'malignant': round(primary['malignant'], 4)},
+        'shadow': {'label': label(shadow), 'malignant': round(shadow['malignant'], 4)},
+    }
+
+if (SHADOW_CHEST_WEIGHTS or SHADOW_MAMMO_RF_MODEL) and SHADOW_SAMPLE_RATE > 0 and multiprocessing.parent_process() is None:
+    SHADOW = ShadowEvaluator(
+        SHADOW_LOG,
+        sample_rate=SHADOW_SAMPLE_RATE,
+        queue_size=SHADOW_QUEUE_SIZE,
+        cpu_fraction=SHADOW_CPU_FRACTION,
+        cpus=usable_cpus(),
+    )
+    if SHADOW_CHEST_WEIGHTS:
+        try:
+            registry.register('shadow_densenet', xrv.models.DenseNet(weights=SHADOW_CHEST_WEIGHTS).eval(), 'torch',
+                              source=SHADOW_CHEST_WEIGHTS)
+            SHADOW.register('chest', ShadowCandidate(SHADOW_CHEST_WEIGHTS, shadow_chest_run, compare_chest))
+        except Exception as e:
+            print(f"[SHADOW] Chest candidate {SHADOW_CHEST_WEIGHTS} failed to load: {e}")
+    if SHADOW_MAMMO_RF_MODEL and SHADOW_MAMMO_RF_SCALER:
+        try:
+            registry.load_joblib('shadow_mammography_rf', SHADOW_MAMMO_RF_MODEL)
+            registry.load_joblib('shadow_mammography_scaler', SHADOW_MAMMO_RF_SCALER)
+            SHADOW.register('mammography', ShadowCandidate(
+                os.path.basename(SHADOW_MAMMO_RF_MODEL), shadow_mammography_run, compare_mammography))
+        except Exception as e:
+            print(f"[SHADOW] Mammography RF candidate failed to load: {e}")
+    if SHADOW.candidates:
+        print(f"[SHADOW] Mirroring {SHADOW_SAMPLE_RATE:.0%} of requests to {sorted(SHADOW.candidates)}, "
+              f"CPU cap {SHADOW_CPU_FRACTION:.0%} of {SHADOW.cpus} CPUs, log {SHADOW_LOG}")
+    else:
+        SHADOW = None
+
+@app.route('/shadow/stats', methods=['GET'])
+def shadow_stats():
+    """Shadow candidates, sampling/drop counters, agreement and primary vs shadow latency"""
+    if SHADOW is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(SHADOW.stats(), enabled=True))
+
+# Startup warmup: synthetic inputs through every registered model, the preprocessing paths and the
+# feature extractors, so real requests don't pay torch lazy init, allocator growth or worker start-up.
+# WARMUP: 'background' (serve /health at once, /ready turns 200 when done), 'blocking' or 'off'.
+# It starts on import, so scripts that import app without serving it set WARMUP=off first.
+WARMUP = os.environ.get('WARMUP', 'background')
+WARMUP_ITERATIONS = int(os.environ.get('WARMUP_ITERATIONS', '2'))
+WARMUP_LOCK = threading.Lock()
+WARMUP_STATE = {'status': 'pending', 'seconds': None, 'steps_ms': {}, 'errors': {}, 'first_request': None}
+# Requests whose latency counts as "first request after warmup"
+INFERENCE_ENDPOINTS = {'analyze', 'batch_analyze', 'mammography_analyze', 'mammography_statistical', 'breast_cancer_predict'}
+
+def synthetic_image(size=1024, seed=0):
+    """Base64 JPEG of a noisy gradient, roughly the decode cost and intensity profile of an upload"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(30, 220, size, dtype=np.float32)[:, None]
+    arr = np.clip(gradient + rng.normal(0, 20, (size, size)), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format='JPEG', quality=90)
+    return base64.b64encode(buf.getvalue()).decode('ascii')
+
+def warmup_step(name, fn, iterations=None):
+    start = time.perf_counter()
+    try:
+        for _ in range(iterations or WARMUP_ITERATIONS):
+            fn()
+    except Exception as e:
+        with WARMUP_LOCK:
+            WARMUP_STATE['errors'][name] = str(e)
+        print(f"[WARMUP] {name} failed: {e}")
+        return
+    with WARMUP_LOCK:
+        WARMUP_STATE['steps_ms'][name] = round((time.perf_counter() - start) * 1000, 1)
+
+def run_warmup():
+    start = time.perf_counter()
+    with WARMUP_LOCK:
+        WARMUP_STATE['status'] = 'warming'
+    print(f"[WARMUP] Warming {len(registry.names())} models, {WARMUP_ITERATIONS} iterations per step...")
+
+    image_data = synthetic_image()
+    raw = decode_payload(image_data)
+    img = decode_image(raw)
+    tensor = image_to_tensor(img)
+
+    warmup_step('decode', lambda: assess_image_quality(decode_image(raw, draft_size=(224, 224))))
+    warmup_step('chest_preprocess', lambda: image_to_tensor(decode_image(raw, draft_size=(224, 224))))
+    if PREPROCESS_POOL is not None:
+        # Starts the forkserver and every worker
+        warmup_step('preprocess_pool', lambda: [item.release() for item in PREPROCESS_POOL.imap([raw] * PREPROCESS_WORKERS)])
+
+    seen = set()
+    for name in registry.names():
+        model = registry[name]
+        if id(model) in seen:
+            continue
+        seen.add(id(model))
+        if registry.kind(name) == 'torch':
+            # Shadow candidates only ever see single images
+            for batch_size in sorted({1} if name.startswith('shadow_') else {1, BATCH_MAX_SIZE}):
+                batch = tensor.expand(batch_size, -1, -1, -1).contiguous()
+                def forward(model=model, batch=batch):
+                    with torch.no_grad():
+                        forward_with_embedding(model, batch)
+                warmup_step(f'{name}[batch={batch_size}]', forward)
+        elif hasattr(model, 'predict_proba'):
+            zeros = np.zeros((1, model.n_features_in_))
+            warmup_step(name, lambda model=model, zeros=zeros: model.predict_proba(zeros))
+        elif hasattr(model, 'transform'):
+            zeros = np.zeros((1, model.n_features_in_))
+            warmup_step(name, lambda model=model, zeros=zeros: model.transform(zeros))
+
+    # Full request paths: batching queue, risk logic, response shaping, features and tiling
+    warmup_step('analyze', lambda: compact_analysis(analyze_with_model(tensor)))
+    if ENSEMBLE_MEMBERS:
+        warmup_step('ensemble', lambda: compact_analysis(ensemble_analysis(tensor)))
+    warmup_step('mammography_features', lambda: extract_mammo_features(img))
+    if MAMMO_MODEL is not None and MAMMO_SCALER is not None:
+        warmup_step('mammography_rf_path', lambda: rf_mammo_probabilities(img))
+    if BREAST_MODEL_AVAILABLE:
+        warmup_step('breast_cancer_path', lambda: predict_breast_cancer([0.0] * 30))
+    # One pass is enough to size the tile batch buffers, and it is the slowest step by far
+    warmup_step('mammography_tiled', lambda: tiled_mass_scores(img), iterations=1)
+    with app.app_context():
+        warmup_step('json', lambda: jsonify({'analysis': analyze_with_model(tensor)}))
+
+    with WARMUP_LOCK:
+        WARMUP_STATE['seconds'] = round(time.perf_counter() - start, 2)
+        WARMUP_STATE['status'] = 'ready'
+    print(f"[WARMUP] Ready after {WARMUP_STATE['seconds']}s ({len(WARMUP_STATE['errors'])} failed steps)")
+
+@app.before_request
+def mark_request_start():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_first_request(response):
+    # A request rejected by an earlier before_request hook never reached mark_request_start
+    start = g.get('request_start')
+    if start is not None and WARMUP_STATE['first_request'] is None and request.endpoint in INFERENCE_ENDPOINTS:
+        with WARMUP_LOCK:
+            if WARMUP_STATE['first_request'] is None and WARMUP_STATE['status'] in ('ready', 'skipped'):
+                WARMUP_STATE['first_request'] = {
+                    'endpoint': request.endpoint,
+                    'status': response.status_code,
+                    'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+                }
+                print(f"[WARMUP] First request after warmup: {WARMUP_STATE['first_request']}")
+    return response
+
+if WARMUP == 'off' or multiprocessing.parent_process() is not None:
+    WARMUP_STATE['status'] = 'skipped'
+elif WARMUP == 'blocking':
+    run_warmup()
+else:
+    threading.Thread(target=run_warmup, name='warmup', daemon=True).start()
+
 if __name__ == '__main__':
     print("Starting Mira ML Service on port 5000...")
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,217 @@
+"""
+Startup Auto-Tuner
+Times synthetic DenseNet forward passes over torch thread counts, batch sizes
+and channels_last, picks the fastest configuration for the machine it runs on
+and saves it to a profile file that app.py applies on later starts.
+
+Container CPU quotas (Fly machines) are not reflected in torch's default thread
+count, so the profile is keyed by a hardware fingerprint (visible CPUs, cgroup
+quota, CPU model, torch version) and ignored when that changes.
+
+The winner is the configuration with the best images/sec whose batch latency
+stays under --max-latency-ms; its batch size becomes the default BATCH_MAX_SIZE.
+
+Usage:
+    python autotune.py
+    python autotune.py --threads 1 2 4 --batch-sizes 1 4 8 --iters 5
+    python autotune.py --output /data/autotune_profile.json --max-latency-ms 300
+
+At boot, app.py applies the saved profile before loading models. Set
+AUTOTUNE_ON_BOOT=missing to calibrate when no matching profile exists, or
+AUTOTUNE_ON_BOOT=always to recalibrate on every start.
+"""
+
+import os
+import json
+import time
+import platform
+import argparse
+
+import torch
+
+DEFAULT_PROFILE_PATH = os.path.join(os.path.dirname(__file__), "autotune_profile.json")
+PROFILE_VERSION = 1
+
+
+def visible_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def cgroup_cpu_quota():
+    """CPUs allowed by the cgroup v2 (or v1) quota, None when unlimited"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else round(int(quota) / int(period), 2)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else round(quota / period, 2)
+    except (OSError, ValueError):
+        return None
+
+
+def cpu_model():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def hardware_fingerprint():
+    return {
+        "cpus": visible_cpus(),
+        "cpu_quota": cgroup_cpu_quota(),
+        "cpu_model": cpu_model(),
+        "torch": torch.__version__,
+    }
+
+
+def usable_cpus():
+    quota = cgroup_cpu_quota()
+    cpus = visible_cpus()
+    return max(1, min(cpus, int(quota))) if quota else cpus
+
+
+def default_thread_candidates():
+    limit = max(usable_cpus(), visible_cpus())
+    candidates = {1, usable_cpus(), limit}
+    n = 2
+    while n < limit:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def load_profile(path=DEFAULT_PROFILE_PATH):
+    """The saved profile if it exists and was calibrated on this hardware, else None"""
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"[AUTOTUNE] Ignoring unreadable profile {path}: {e}")
+        return None
+    if profile.get("version") != PROFILE_VERSION:
+        print(f"[AUTOTUNE] Ignoring profile {path}: version {profile.get('version')}")
+        return None
+    if profile.get("fingerprint") != hardware_fingerprint():
+        print(f"[AUTOTUNE] Ignoring profile {path}: calibrated on different hardware")
+        return None
+    return profile
+
+
+def save_profile(profile, path=DEFAULT_PROFILE_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp, path)
+
+
+def time_config(model, threads, batch_size, iters, image_size=224):
+    torch.set_num_threads(threads)
+    x = torch.randn(batch_size, 1, image_size, image_size) * 512
+    with torch.no_grad():
+        model(x)  # warm-up: allocator, kernel selection
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(x)
+        elapsed = time.perf_counter() - start
+    latency = elapsed / iters
+    return {
+        "threads": threads,
+        "batch_size": batch_size,
+        "latency_ms": round(latency * 1000, 2),
+        "images_per_sec": round(batch_size / latency, 2),
+    }
+
+
+def calibrate(model, thread_candidates=None, batch_sizes=(1, 2, 4, 8, 16), iters=3,
+              max_latency_ms=500.0, try_channels_last=True):
+    """Time every configuration on ``model`` and return a profile (model is left in the winning format)"""
+    thread_candidates = thread_candidates or default_thread_candidates()
+    original_threads = torch.get_num_threads()
+    formats = [False, True] if try_channels_last else [False]
+    results = []
+    start = time.perf_counter()
+    try:
+        for channels_last in formats:
+            model.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+            for threads in thread_candidates:
+                for batch_size in batch_sizes:
+                    result = time_config(model, threads, batch_size, iters)
+                    result["channels_last"] = channels_last
+                    results.append(result)
+                    print(f"[AUTOTUNE] threads={threads:<3} batch={batch_size:<3} channels_last={channels_last!s:<5} "
+                          f"{result['latency_ms']:>9.1f} ms  {result['images_per_sec']:>7.1f} img/s")
+    finally:
+        torch.set_num_threads(original_threads)
+
+    within_budget = [r for r in results if r["latency_ms"] <= max_latency_ms]
+    if not within_budget:
+        # Nothing meets the budget: fall back to the lowest-latency single-image configuration
+        within_budget = [min((r for r in results if r["batch_size"] == min(batch_sizes)),
+                             key=lambda r: r["latency_ms"])]
+    best = max(within_budget, key=lambda r: r["images_per_sec"])
+    model.to(memory_format=torch.channels_last if best["channels_last"] else torch.contiguous_format)
+
+    return {
+        "version": PROFILE_VERSION,
+        "fingerprint": hardware_fingerprint(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "calibration_seconds": round(time.perf_counter() - start, 1),
+        "max_latency_ms": max_latency_ms,
+        "torch_threads": best["threads"],
+        # Eager-mode DenseNet never schedules inter-op work, so its pool only needs one thread
+        "interop_threads": 1,
+        "batch_size": best["batch_size"],
+        "channels_last": best["channels_last"],
+        "best": best,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate torch threading and batch size for this machine")
+    parser.add_argument("--output", default=os.environ.get("AUTOTUNE_PROFILE", DEFAULT_PROFILE_PATH))
+    parser.add_argument("--threads", type=int, nargs="+", help="Thread counts to try (default: 1, powers of 2, CPU count)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--iters", type=int, default=3, help="Timed forward passes per configuration")
+    parser.add_argument("--max-latency-ms", type=float, default=500.0, help="Upper bound on one batch's latency")
+    parser.add_argument("--no-channels-last", action="store_true", help="Only try the default memory format")
+    parser.add_argument("--weights", default="densenet121-res224-all")
+    args = parser.parse_args()
+
+    import torchxrayvision as xrv
+
+    print(f"[AUTOTUNE] Hardware: {hardware_fingerprint()}")
+    model = xrv.models.DenseNet(weights=args.weights).eval()
+    profile = calibrate(
+        model,
+        thread_candidates=args.threads,
+        batch_sizes=args.batch_sizes,
+        iters=args.iters,
+        max_latency_ms=args.max_latency_ms,
+        try_channels_last=not args.no_channels_last,
+    )
+    save_profile(profile, args.output)
+    best = profile["best"]
+    print(f"\n[AUTOTUNE] Best: threads={profile['torch_threads']} batch={profile['batch_size']} "
+          f"channels_last={profile['channels_last']} ({best['images_per_sec']} img/s, {best['latency_ms']} ms/batch)")
+    print(f"[AUTOTUNE] Profile saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
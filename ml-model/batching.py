@@ -0,0 +1,82 @@
+"""
+Shared inference batching queue
+Request threads submit single-image tensors; one worker thread gathers
+whatever arrives within a short window into one batch, runs the model once
+and hands each caller its own rows back.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+class MicroBatcher:
+    def __init__(self, fn, max_batch=8, max_wait_ms=2.0, name="batcher"):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, tensor):
+        """Queue a (n, ...) tensor; the future resolves to fn's output rows for it"""
+        future = Future()
+        self._queue.put((tensor, future))
+        return future
+
+    def __call__(self, tensor):
+        return self.submit(tensor).result()
+
+    def _collect(self):
+        items = [self._queue.get()]
+        size = len(items[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            tensors = [t for t, _ in items]
+            try:
+                with torch.no_grad():
+                    outputs = self.fn(tensors[0] if len(tensors) == 1 else torch.cat(tensors))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            start = 0
+            for tensor, future in items:
+                end = start + len(tensor)
+                if isinstance(outputs, tuple):
+                    future.set_result(tuple(o[start:end] for o in outputs))
+                else:
+                    future.set_result(outputs[start:end])
+                start = end
+
+    def stats(self):
+        return {
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch': round(self.items / self.batches, 2) if self.batches else None,
+        }
@@ -0,0 +1,150 @@
+"""
+Ensemble Latency Benchmark
+Measures what each additional xrv weight set adds to one chest X-ray forward
+pass, for ensembles of 1..N members. Members run sequentially and in parallel
+(one batching queue per member, as app.py does for ENSEMBLE_WEIGHTS), with
+one or more concurrent clients, so the ensemble size can be chosen from
+measurements on the target machine.
+
+Every parallel member uses torch's whole intra-op thread pool, so n members
+can run n x torch threads at once. The "single under load" columns show what
+that costs everyone else: single-model latency while an ensemble load (parallel
+or sequential) runs alongside. Prefer ENSEMBLE_PARALLEL=0 when the parallel
+load slows single-model requests more than it speeds up the ensemble.
+
+Usage:
+    python benchmark_ensemble.py
+    python benchmark_ensemble.py --weights densenet121-res224-nih densenet121-res224-chex --iters 20
+    python benchmark_ensemble.py --clients 4 --batch-max-size 8
+"""
+
+import time
+import argparse
+import threading
+import statistics
+
+import torch
+import torchxrayvision as xrv
+
+from batching import MicroBatcher
+from autotune import usable_cpus
+
+DEFAULT_WEIGHTS = [
+    "densenet121-res224-all",
+    "densenet121-res224-nih",
+    "densenet121-res224-chex",
+    "densenet121-res224-mimic_ch",
+    "densenet121-res224-pc",
+]
+
+
+def run_sequential(members, x):
+    with torch.no_grad():
+        for model in members:
+            model(x)
+
+
+def run_parallel(batchers, x):
+    futures = [batcher.submit(x) for batcher in batchers]
+    for future in futures:
+        future.result()
+
+
+def run_sequential_batched(batchers, x):
+    for batcher in batchers:
+        batcher.submit(x).result()
+
+
+def measure_under_load(fn, load, iters):
+    """Latencies of ``fn`` from one client while another thread keeps calling ``load``"""
+    stop = threading.Event()
+
+    def background():
+        while not stop.is_set():
+            load()
+
+    thread = threading.Thread(target=background, daemon=True)
+    thread.start()
+    try:
+        return measure(fn, iters, 1)
+    finally:
+        stop.set()
+        thread.join()
+
+
+def measure(fn, iters, clients):
+    """Per-request latencies (ms) with ``clients`` threads each making ``iters`` requests"""
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        for _ in range(iters):
+            start = time.perf_counter()
+            fn()
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    fn()  # warm-up
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "rps": len(latencies) / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency added by each member of a multi-weight ensemble")
+    parser.add_argument("--weights", nargs="+", default=DEFAULT_WEIGHTS, help="First entry is the single-model baseline")
+    parser.add_argument("--iters", type=int, default=10, help="Requests per client")
+    parser.add_argument("--clients", type=int, default=1, help="Concurrent request threads")
+    parser.add_argument("--batch-max-size", type=int, default=8)
+    parser.add_argument("--batch-max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    threads, cpus = torch.get_num_threads(), usable_cpus()
+    print(f"torch threads: {threads}, usable CPUs: {cpus}, clients: {args.clients}, iters: {args.iters}")
+    models = []
+    for weights in args.weights:
+        models.append(xrv.models.DenseNet(weights=weights).eval())
+        print(f"Loaded {weights}")
+
+    batchers = [
+        MicroBatcher(model, max_batch=args.batch_max_size, max_wait_ms=args.batch_max_wait_ms, name=f"member-{i}")
+        for i, model in enumerate(models)
+    ]
+    x = torch.randn(1, 1, 224, 224) * 512
+
+    print(f"\n{'members':>7} {'seq p50 ms':>11} {'par p50 ms':>11} {'par p95 ms':>11} {'par req/s':>10} "
+          f"{'overhead ms':>12} {'x single':>9} {'single|par ms':>14} {'single|seq ms':>14} {'threads':>8}")
+    baseline = None
+    for n in range(1, len(models) + 1):
+        sequential = measure(lambda: run_sequential(models[:n], x), args.iters, args.clients)
+        parallel = measure(lambda: run_parallel(batchers[:n], x), args.iters, args.clients)
+        if baseline is None:
+            baseline = parallel["p50"]
+        # Single-model requests sharing the process with an ensemble load in each mode
+        single = lambda: run_sequential(models[:1], x)
+        under_parallel = measure_under_load(single, lambda: run_parallel(batchers[:n], x), args.iters)
+        under_sequential = measure_under_load(single, lambda: run_sequential_batched(batchers[:n], x), args.iters)
+        busy = n * threads
+        print(f"{n:>7} {sequential['p50']:>11.1f} {parallel['p50']:>11.1f} {parallel['p95']:>11.1f} "
+              f"{parallel['rps']:>10.1f} {parallel['p50'] - baseline:>12.1f} {parallel['p50'] / baseline:>9.2f} "
+              f"{under_parallel['p50']:>14.1f} {under_sequential['p50']:>14.1f} "
+              f"{busy:>8}{' > CPUs' if busy > cpus else ''}")
+
+    print("\nApply with ENSEMBLE_WEIGHTS=<members 2..n, comma separated>; /models reports the live overhead.")
+    print("threads = parallel member forwards x torch threads; past the CPU count the members contend, and")
+    print("ENSEMBLE_PARALLEL=0 (the single|seq column) usually serves other requests better.")
+
+
+if __name__ == "__main__":
+    main()
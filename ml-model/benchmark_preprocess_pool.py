@@ -0,0 +1,104 @@
+"""
+Preprocessing Pool Benchmark
+Measures decode + resize + normalize throughput in-process versus the
+shared-memory process pool with 1..N workers.
+
+Usage:
+    python benchmark_preprocess_pool.py
+    python benchmark_preprocess_pool.py --images 200 --size 2048 --max-workers 4
+    python benchmark_preprocess_pool.py --files ../covid-xray.jpg ../breast-xray-1.jpg
+"""
+
+import io
+import os
+import time
+import base64
+import argparse
+import threading
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import decode_image, make_thumbnail, image_to_array, assess_thumbnail_quality
+from preprocess_pool import PreprocessPool
+
+
+def synthetic_images(count, size, seed=0):
+    """JPEG-encoded noisy gradients, roughly the cost profile of real uploads"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        gradient = np.linspace(40, 200, size, dtype=np.float32)[None, :]
+        arr = np.clip(gradient + rng.normal(0, 25, (size, size)), 0, 255).astype(np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(arr).save(buf, format="JPEG", quality=90)
+        images.append(base64.b64encode(buf.getvalue()).decode("ascii"))
+    return images
+
+
+def load_files(paths, repeat):
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(base64.b64encode(f.read()).decode("ascii"))
+    return images * repeat
+
+
+def run_inline(images):
+    start = time.perf_counter()
+    for image_data in images:
+        img = decode_image(image_data, draft_size=(224, 224))
+        assess_thumbnail_quality(make_thumbnail(img)[None])
+        image_to_array(img)
+    return time.perf_counter() - start
+
+
+def run_pool(pool, images, clients):
+    """``clients`` request threads each pushing their share of images through the pool"""
+    shares = [images[i::clients] for i in range(clients)]
+
+    def client(share):
+        for item in pool.imap(share):
+            if isinstance(item, Exception):
+                raise item
+            item.release()
+
+    threads = [threading.Thread(target=client, args=(share,)) for share in shares]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing process pool")
+    parser.add_argument("--images", type=int, default=100, help="Number of synthetic images")
+    parser.add_argument("--size", type=int, default=2048, help="Synthetic image side in pixels")
+    parser.add_argument("--files", nargs="+", help="Use these image files instead of synthetic ones")
+    parser.add_argument("--repeat", type=int, default=20, help="Repeat --files this many times")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent request threads")
+    args = parser.parse_args()
+
+    images = load_files(args.files, args.repeat) if args.files else synthetic_images(args.images, args.size)
+    print(f"{len(images)} images, {args.clients} client threads, {os.cpu_count()} CPUs visible\n")
+
+    baseline = run_inline(images)
+    print(f"{'mode':>10}  {'img/s':>8}  {'speedup':>8}  {'efficiency':>10}")
+    print(f"{'inline':>10}  {len(images) / baseline:>8.1f}  {1.0:>8.2f}  {'-':>10}")
+
+    for workers in range(1, args.max_workers + 1):
+        pool = PreprocessPool(workers)
+        try:
+            run_pool(pool, images[:workers], clients=1)  # start workers outside the timing
+            elapsed = run_pool(pool, images, args.clients)
+        finally:
+            pool.close()
+        speedup = baseline / elapsed
+        print(f"{workers:>7} wk  {len(images) / elapsed:>8.1f}  {speedup:>8.2f}  {speedup / workers:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+DenseNet Embedding Index
+Compact on-disk store of penultimate-layer embeddings for longitudinal comparison.
+
+Layout of the index directory:
+    vectors.f32  - raw float32 rows, L2-normalized, appended one per study
+    meta.jsonl   - one JSON object per row (patient_id, study_id, created_at, ...)
+
+Rows are only ever appended, so a crash can at worst leave a partial tail,
+which is trimmed on load.
+"""
+import os
+import json
+import time
+import threading
+import datetime
+import numpy as np
+
+
+def _study_time(meta):
+    """Epoch seconds of a study: its ISO study_date when it parses, else when it was indexed"""
+    try:
+        date = datetime.datetime.fromisoformat(str(meta["study_date"]))
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return date.timestamp()
+    except (KeyError, TypeError, ValueError):
+        return meta["created_at"]
+
+
+class EmbeddingIndex:
+    def __init__(self, directory, dim=1024):
+        self.directory = directory
+        self.dim = dim
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "meta.jsonl")
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._meta = []
+        self._by_patient = {}
+        self._by_study = {}
+        self._load()
+
+    def __len__(self):
+        return self._size
+
+    def _load(self):
+        if not os.path.exists(self.vectors_path) or not os.path.exists(self.meta_path):
+            return
+        meta = []
+        with open(self.meta_path, "r") as f:
+            for line in f:
+                try:
+                    meta.append(json.loads(line))
+                except ValueError:
+                    break
+        vectors = np.fromfile(self.vectors_path, dtype=np.float32)
+        rows = min(len(meta), vectors.size // self.dim)
+        if rows != len(meta) or rows * self.dim * 4 != os.path.getsize(self.vectors_path):
+            print(f"[EMBEDDINGS] Trimming index to {rows} consistent rows")
+            self._rewrite(vectors[:rows * self.dim], meta[:rows])
+
+        self._vectors = vectors[:rows * self.dim].reshape(rows, self.dim).copy()
+        self._size = rows
+        for row, m in enumerate(meta[:rows]):
+            self._register(row, m)
+        self._meta = meta[:rows]
+        print(f"[EMBEDDINGS] Loaded {rows} embeddings from {self.directory}")
+
+    def _rewrite(self, vectors, meta):
+        vectors.astype(np.float32).tofile(self.vectors_path)
+        with open(self.meta_path, "w") as f:
+            for m in meta:
+                f.write(json.dumps(m) + "\n")
+
+    def _register(self, row, meta):
+        self._by_patient.setdefault(meta.get("patient_id"), []).append(row)
+        if meta.get("study_id"):
+            self._by_study[meta["study_id"]] = row
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        return vector / (np.linalg.norm(vector) + 1e-8)
+
+    def add(self, embedding, patient_id, study_id=None, **extra):
+        """Append one embedding; returns its row id"""
+        vector = self._normalize(embedding)
+        if vector.size != self.dim:
+            raise ValueError(f"Expected {self.dim}-d embedding, got {vector.size}")
+        meta = {"patient_id": str(patient_id), "study_id": study_id, "created_at": time.time()}
+        meta.update({k: v for k, v in extra.items() if v is not None})
+
+        with self._lock:
+            if study_id and study_id in self._by_study:
+                raise ValueError(f"Study {study_id} is already indexed")
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.vectors_path, "ab") as f:
+                vector.tofile(f)
+            with open(self.meta_path, "a") as f:
+                f.write(json.dumps(meta) + "\n")
+
+            # Grow the in-memory matrix geometrically so appends stay amortized O(1)
+            if self._size == len(self._vectors):
+                grown = np.zeros((max(64, 2 * len(self._vectors)), self.dim), dtype=np.float32)
+                grown[:self._size] = self._vectors[:self._size]
+                self._vectors = grown
+            row = self._size
+            self._vectors[row] = vector
+            self._meta.append(meta)
+            self._register(row, meta)
+            self._size += 1
+        return row
+
+    def get(self, row):
+        return self._vectors[row].copy(), dict(self._meta[row], row=row)
+
+    def row_for_study(self, study_id):
+        return self._by_study.get(study_id)
+
+    def search(self, embedding, k=5, patient_id=None, exclude_row=None):
+        """Cosine nearest neighbours, optionally restricted to one patient"""
+        query = self._normalize(embedding)
+        with self._lock:
+            if patient_id is not None:
+                rows = np.array(self._by_patient.get(str(patient_id), []), dtype=np.int64)
+                candidates = self._vectors[rows] if len(rows) else np.zeros((0, self.dim), np.float32)
+            else:
+                rows = None
+                candidates = self._vectors[:self._size]
+            sims = candidates @ query
+
+        if exclude_row is not None:
+            if rows is None:
+                if 0 <= exclude_row < len(sims):
+                    sims[exclude_row] = -np.inf
+            else:
+                sims[rows == exclude_row] = -np.inf
+        k = min(k, int(np.isfinite(sims).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [
+            dict(self._meta[int(rows[i]) if rows is not None else int(i)],
+                 row=int(rows[i]) if rows is not None else int(i),
+                 similarity=round(float(sims[i]), 6))
+            for i in top
+        ]
+
+    def patient_history(self, patient_id):
+        """All studies of a patient by study_date (else indexing time), with similarity to the baseline and previous study"""
+        with self._lock:
+            rows = list(self._by_patient.get(str(patient_id), []))
+            rows.sort(key=lambda r: (_study_time(self._meta[r]), self._meta[r]["created_at"], r))
+            vectors = self._vectors[rows]
+            meta = [self._meta[r] for r in rows]
+        if not rows:
+            return []
+
+        to_baseline = vectors @ vectors[0]
+        to_previous = np.concatenate([[1.0], np.einsum("ij,ij->i", vectors[1:], vectors[:-1])])
+        return [
+            dict(m, row=r,
+                 similarity_to_baseline=round(float(b), 6),
+                 similarity_to_previous=round(float(p), 6))
+            for r, m, b, p in zip(rows, meta, to_baseline, to_previous)
+        ]
@@ -0,0 +1,142 @@
+"""
+Mammography Cascade Evaluation
+Measures how often the RF -> DenseNet cascade answers from the cheap RF stage
+and what that costs in accuracy, on a labelled local image set.
+
+The dataset directory must contain one sub-folder per label:
+    <data_dir>/benign/*.png|jpg
+    <data_dir>/malignant/*.png|jpg
+
+Usage:
+    python evaluate_cascade.py --data-dir tcia_samples/labelled
+    python evaluate_cascade.py --data-dir tcia_samples/labelled --thresholds 0.8 0.85 0.9 0.95
+"""
+
+import os
+import json
+import time
+import argparse
+
+from PIL import Image
+
+# No startup warmup: it would compete for the CPU with the stage latencies measured here
+os.environ.setdefault("WARMUP", "off")
+import app as ml
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+LABELS = ("benign", "malignant")
+
+
+def load_samples(data_dir):
+    samples = []
+    for label in LABELS:
+        folder = os.path.join(data_dir, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(folder, name), label))
+    return samples
+
+
+def score_samples(samples, tiled=False):
+    """Run both stages once per image; thresholds are then swept offline"""
+    scored = []
+    for path, label in samples:
+        img = Image.open(path).convert("L")
+
+        start = time.perf_counter()
+        _, malignant_prob, benign_prob, _ = ml.rf_mammo_probabilities(img)
+        rf_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        if tiled:
+            mass_prob = ml.tiled_mass_scores(img)["max_mass_prob"]
+        else:
+            mass_prob = ml.densenet_mass_prob(img)
+        densenet_ms = (time.perf_counter() - start) * 1000
+
+        scored.append({
+            "path": path,
+            "label": label,
+            "rf_malignant": malignant_prob,
+            "rf_benign": benign_prob,
+            "rf_label": "malignant" if malignant_prob > benign_prob else "benign",
+            "densenet_label": "malignant" if ml.map_mass_prob_to_birads(mass_prob)["birads_score"] >= 4 else "benign",
+            "rf_ms": rf_ms,
+            "densenet_ms": densenet_ms,
+        })
+    return scored
+
+
+def evaluate(scored, benign_threshold, malignant_threshold):
+    n = len(scored)
+    skipped = 0
+    correct = 0
+    latency = 0.0
+    for s in scored:
+        exit_label = ml.cascade_exit(s["rf_malignant"], s["rf_benign"], benign_threshold, malignant_threshold)
+        if exit_label:
+            skipped += 1
+            predicted = exit_label
+            latency += s["rf_ms"]
+        else:
+            predicted = s["densenet_label"]
+            latency += s["rf_ms"] + s["densenet_ms"]
+        correct += predicted == s["label"]
+
+    densenet_accuracy = sum(s["densenet_label"] == s["label"] for s in scored) / n
+    cascade_accuracy = correct / n
+    return {
+        "benign_threshold": benign_threshold,
+        "malignant_threshold": malignant_threshold,
+        "skip_fraction": round(skipped / n, 4),
+        "cascade_accuracy": round(cascade_accuracy, 4),
+        "densenet_accuracy": round(densenet_accuracy, 4),
+        "accuracy_cost": round(densenet_accuracy - cascade_accuracy, 4),
+        "mean_latency_ms": round(latency / n, 2),
+        "densenet_latency_ms": round(sum(s["densenet_ms"] for s in scored) / n, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the mammography confidence cascade")
+    parser.add_argument("--data-dir", required=True, help="Directory with benign/ and malignant/ sub-folders")
+    parser.add_argument("--thresholds", type=float, nargs="+",
+                        default=[0.7, 0.8, 0.85, 0.9, 0.95, 0.99],
+                        help="Confidence thresholds to sweep (applied to both classes)")
+    parser.add_argument("--tiled", action="store_true", help="Use tiled DenseNet as the expensive stage")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    if ml.MAMMO_MODEL is None or ml.MAMMO_SCALER is None:
+        print("RF model not loaded - nothing to cascade from")
+        return
+
+    samples = load_samples(args.data_dir)
+    if not samples:
+        print(f"No labelled images found under {args.data_dir}")
+        return
+
+    print(f"Scoring {len(samples)} images...")
+    scored = score_samples(samples, tiled=args.tiled)
+    rf_accuracy = sum(s["rf_label"] == s["label"] for s in scored) / len(scored)
+
+    rows = [evaluate(scored, t, t) for t in args.thresholds]
+
+    print(f"\nRF-only accuracy: {rf_accuracy:.4f}")
+    print(f"DenseNet-only accuracy: {rows[0]['densenet_accuracy']:.4f} "
+          f"({rows[0]['densenet_latency_ms']:.1f} ms/image)\n")
+    print(f"{'threshold':>9}  {'skip':>6}  {'accuracy':>8}  {'cost':>7}  {'ms/image':>8}")
+    for row in rows:
+        print(f"{row['benign_threshold']:>9.2f}  {row['skip_fraction']:>6.1%}  "
+              f"{row['cascade_accuracy']:>8.4f}  {row['accuracy_cost']:>+7.4f}  {row['mean_latency_ms']:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"samples": len(scored), "rf_accuracy": rf_accuracy, "sweep": rows}, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
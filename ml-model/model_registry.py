@@ -0,0 +1,92 @@
+"""
+Shared model registry
+One place that loads and owns every model the ML gateway serves, so a model
+file used by several routes is loaded, and counted in memory, exactly once.
+"""
+import os
+import sys
+import threading
+import numpy as np
+
+try:
+    import joblib
+except Exception:
+    joblib = None
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._models = {}
+        self._info = {}
+        self._by_path = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._models
+
+    def __getitem__(self, name):
+        return self._models[name]
+
+    def get(self, name, default=None):
+        return self._models.get(name, default)
+
+    def names(self):
+        return list(self._models)
+
+    def kind(self, name):
+        return self._info[name]['kind']
+
+    def source(self, name):
+        return self._info[name]['source']
+
+    def register(self, name, model, kind, source=None):
+        with self._lock:
+            self._models[name] = model
+            self._info[name] = {'kind': kind, 'source': source}
+        return model
+
+    def load_joblib(self, name, path):
+        """Load a joblib artifact once per path; later names alias the same object"""
+        if joblib is None:
+            raise RuntimeError("joblib is not installed")
+        path = os.path.abspath(path)
+        with self._lock:
+            cached = self._by_path.get(path)
+        if cached is None:
+            # Compatibility alias for models saved with numpy 2.x
+            sys.modules.setdefault("numpy._core", np.core)
+            cached = joblib.load(path)
+            with self._lock:
+                cached = self._by_path.setdefault(path, cached)
+        return self.register(name, cached, 'joblib', source=path)
+
+    @staticmethod
+    def _torch_bytes(model):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def summary(self):
+        """Per-name info plus a memory total where shared objects are counted once"""
+        entries = []
+        seen = {}
+        with self._lock:
+            items = list(self._models.items())
+            info = dict(self._info)
+        for name, model in items:
+            entry = dict(info[name], name=name)
+            if info[name]['kind'] == 'torch':
+                size = self._torch_bytes(model)
+            elif info[name]['source'] and os.path.exists(info[name]['source']):
+                size = os.path.getsize(info[name]['source'])
+            else:
+                size = 0
+            entry['approx_mb'] = round(size / 1e6, 2)
+            shared_with = seen.get(id(model))
+            if shared_with:
+                entry['shared_with'] = shared_with
+            else:
+                seen[id(model)] = name
+                entry['counted'] = True
+            entries.append(entry)
+        total = sum(e['approx_mb'] for e in entries if e.get('counted'))
+        return {'models': entries, 'total_mb': round(total, 2)}
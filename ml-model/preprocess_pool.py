@@ -0,0 +1,242 @@
+"""
+Multi-process preprocessing pool
+Worker processes decode, gate, resize and normalize images and write the
+float32 tensors straight into slots of one shared-memory block. The caller
+gets a numpy view on its slot, so nothing is pickled or copied on the way to
+the model; only the small uint8 quality thumbnail report travels back.
+
+Workers are forked from a forkserver that preloads only this module and
+``preprocessing`` (PIL + numpy), never torch or the model-loading app.
+
+A crashed worker breaks the executor; it is replaced and the job retried once.
+A slot is only recycled once both the worker has finished writing it and the
+caller has released it, so a timed-out job can never scribble over a slot that
+was handed to someone else.
+"""
+import queue
+import collections
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+from preprocessing import decode_image, make_thumbnail, image_to_array, assess_thumbnail_quality
+
+# Set in each worker by _init_worker
+_WORKER_SHM = None
+_WORKER_SLOTS = None
+
+
+def _init_worker(shm_name, shape):
+    global _WORKER_SHM, _WORKER_SLOTS
+    _WORKER_SHM = shared_memory.SharedMemory(name=shm_name)
+    _WORKER_SLOTS = np.ndarray(shape, dtype=np.float32, buffer=_WORKER_SHM.buf)
+
+
+def _preprocess_into_slot(slot, image_data, target_size, thumbnail_size, draft, reject_poor):
+    """Worker side: returns the quality report and whether the slot was filled"""
+    img = decode_image(image_data, draft_size=(target_size, target_size) if draft else None)
+    quality = assess_thumbnail_quality(make_thumbnail(img, thumbnail_size)[None])[0]
+    if reject_poor and quality["quality"] == "poor":
+        return quality, False
+    image_to_array(img, target_size, out=_WORKER_SLOTS[slot])
+    return quality, True
+
+
+class PreprocessedImage:
+    """A filled slot; ``array`` is a (1, 1, H, W) view into shared memory"""
+
+    def __init__(self, pool, slot, quality, filled):
+        self._pool = pool
+        self.slot = slot
+        self.quality = quality
+        self.array = pool._slots[slot:slot + 1] if filled else None
+
+    def release(self):
+        if self._pool is not None:
+            self.array = None
+            self._pool._release(self.slot)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class PreprocessPool:
+    def __init__(self, workers, slots=None, target_size=224, thumbnail_size=128, draft=True, timeout=30.0):
+        self.workers = workers
+        self.target_size = target_size
+        self.thumbnail_size = thumbnail_size
+        self.draft = draft
+        self.timeout = timeout
+        self.num_slots = slots or 4 * workers
+        self.restarts = 0
+
+        shape = (self.num_slots, 1, target_size, target_size)
+        self._shape = shape
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        self._slots = np.ndarray(shape, dtype=np.float32, buffer=self._shm.buf)
+
+        self._free = queue.Queue()
+        for slot in range(self.num_slots):
+            self._free.put(slot)
+        # slot -> number of parties (worker job, consumer) still holding it
+        self._holders = {}
+        self._lock = threading.Lock()
+
+        try:
+            self._ctx = mp.get_context('forkserver')
+            self._ctx.set_forkserver_preload(['preprocessing', 'preprocess_pool'])
+        except ValueError:
+            self._ctx = mp.get_context('spawn')
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._ctx,
+            initializer=_init_worker,
+            initargs=(self._shm.name, self._shape),
+        )
+
+    def _restart(self, broken):
+        """Replace a broken executor (once, however many callers notice it)"""
+        with self._lock:
+            if self._executor is broken:
+                print(f"[PREPROCESS] Worker crashed - restarting pool of {self.workers}")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+                self.restarts += 1
+
+    def _release(self, slot):
+        with self._lock:
+            self._holders[slot] -= 1
+            done = self._holders[slot] == 0
+            if done:
+                del self._holders[slot]
+        if done:
+            self._free.put(slot)
+
+    def _acquire(self, block=True):
+        try:
+            slot = self._free.get(timeout=self.timeout) if block else self._free.get_nowait()
+        except queue.Empty:
+            if not block:
+                return None
+            raise RuntimeError("Preprocessing pool saturated - no free tensor slots")
+        with self._lock:
+            self._holders[slot] = 2  # the worker job and the consumer
+        return slot
+
+    def _submit(self, slot, image_data, reject_poor):
+        args = (slot, image_data, self.target_size, self.thumbnail_size, self.draft, reject_poor)
+        executor = self._executor
+        try:
+            return executor, executor.submit(_preprocess_into_slot, *args)
+        except (BrokenProcessPool, RuntimeError):
+            self._restart(executor)
+            executor = self._executor
+            return executor, executor.submit(_preprocess_into_slot, *args)
+
+    def _start(self, image_data, reject_poor, block=True):
+        slot = self._acquire(block)
+        if slot is None:
+            return None
+        try:
+            executor, future = self._submit(slot, image_data, reject_poor)
+        except Exception:
+            self._release(slot)
+            self._release(slot)
+            raise
+        return slot, executor, future
+
+    def _finish(self, image_data, reject_poor, slot, executor, future):
+        """Wait for a job, retrying once on a fresh pool if a worker died under it"""
+        retried = False
+        while True:
+            try:
+                quality, filled = future.result(timeout=self.timeout)
+            except BrokenProcessPool:
+                self._restart(executor)
+                if not retried:
+                    retried = True
+                    try:
+                        executor, future = self._submit(slot, image_data, reject_poor)
+                    except Exception:
+                        self._release(slot)
+                        self._release(slot)
+                        raise
+                    continue
+                self._release(slot)
+                self._release(slot)
+                raise ValueError("Failed to process image: preprocessing worker crashed")
+            except TimeoutError:
+                # The worker may still write this slot; free it only when the job ends
+                self._abandon(slot, future)
+                raise ValueError("Failed to process image: preprocessing timed out")
+            except Exception:
+                self._release(slot)
+                self._release(slot)
+                raise
+            self._release(slot)
+            return PreprocessedImage(self, slot, quality, filled)
+
+    def _abandon(self, slot, future):
+        """Give up on a started job: free the slot once the worker is done with it"""
+        future.add_done_callback(lambda _: self._release(slot))
+        self._release(slot)
+
+    def preprocess(self, image_data, reject_poor=False):
+        """Preprocess one image; use the result as a context manager to free its slot"""
+        return self._finish(image_data, reject_poor, *self._start(image_data, reject_poor))
+
+    def imap(self, images, reject_poor=False):
+        """Yield one PreprocessedImage (or the exception raised for it) per image, in order.
+
+        Keeps at most ``num_slots - 1`` jobs in flight and only waits for a free
+        slot when it has nothing else in flight, so concurrent callers cannot
+        deadlock each other. Release each item before asking for the next.
+        Jobs still in flight when the caller stops iterating early are abandoned
+        and their slots freed.
+        """
+        window = max(1, self.num_slots - 1)
+        images = list(images)
+        pending = collections.deque()
+        i = 0
+        try:
+            while i < len(images) or pending:
+                while i < len(images) and len(pending) < window:
+                    try:
+                        job = self._start(images[i], reject_poor, block=not pending)
+                    except Exception as e:
+                        job = e
+                    if job is None:
+                        break  # no free slot right now; drain what is already running
+                    pending.append((images[i], job))
+                    i += 1
+
+                image_data, job = pending.popleft()
+                if isinstance(job, Exception):
+                    yield job
+                    continue
+                try:
+                    result = self._finish(image_data, reject_poor, *job)
+                except Exception as e:
+                    result = e
+                yield result
+        finally:
+            for _, job in pending:
+                if not isinstance(job, Exception):
+                    slot, _, future = job
+                    self._abandon(slot, future)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._slots = None
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,189 @@
+"""
+Image preprocessing shared by the ML services
+Decode, thumbnail, quality metrics, xrv-style normalization and the
+mammography RF features, using only PIL and numpy so it can also run inside
+lightweight worker processes that never import torch.
+"""
+import io
+import os
+import base64
+import numpy as np
+from PIL import Image
+
+# Quality gate on a decode-time thumbnail: 'off', 'flag' (report only) or 'reject' (stop before inference)
+QUALITY_GATE = os.environ.get('QUALITY_GATE', 'flag')
+QUALITY_THUMBNAIL_SIZE = int(os.environ.get('QUALITY_THUMBNAIL_SIZE', '128'))
+QUALITY_BLUR_THRESHOLD = float(os.environ.get('QUALITY_BLUR_THRESHOLD', '0.0005'))
+
+
+# Bytes per pixel of a fully decoded image, by PIL mode
+MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'LA': 2, 'I;16': 2, 'I;16B': 2, 'RGB': 3, 'YCbCr': 3,
+              'LAB': 3, 'HSV': 3, 'RGBA': 4, 'CMYK': 4, 'I': 4, 'F': 4}
+
+
+def decode_payload(image_data):
+    """Base64 (optionally a data URL) to bytes; bytes are returned unchanged"""
+    if isinstance(image_data, str):
+        # Check if base64
+        if ',' in image_data:
+            # Remove data URL prefix
+            image_data = image_data.split(',')[1]
+
+        # Decode base64
+        image_data = base64.b64decode(image_data)
+    return image_data
+
+
+def read_image_header(raw):
+    """Dimensions and mode from the image header alone - no pixel data is decoded"""
+    try:
+        with Image.open(io.BytesIO(raw)) as img:
+            width, height = img.size
+            return {
+                'width': width,
+                'height': height,
+                'mode': img.mode,
+                'format': img.format,
+            }
+    except Exception as e:
+        raise ValueError(f"Failed to process image: {str(e)}")
+
+
+def decoded_size(header, draft_size=None):
+    """(pixels, bytes) of the decoded image; JPEG draft decoding shrinks each side by up to 8x"""
+    width, height = header['width'], header['height']
+    if draft_size and header['format'] == 'JPEG':
+        scale = 1
+        while scale < 8 and width // (scale * 2) >= draft_size[0] and height // (scale * 2) >= draft_size[1]:
+            scale *= 2
+        width, height = -(-width // scale), -(-height // scale)
+    return width * height, width * height * MODE_BYTES.get(header['mode'], 4)
+
+
+def decode_image(image_data, draft_size=None):
+    """Decode base64 (optionally a data URL) or raw bytes into a grayscale PIL image.
+
+    ``draft_size`` lets JPEG decoding run at a reduced scale (never below that size)
+    when the caller only needs a small image anyway.
+    """
+    try:
+        image_data = decode_payload(image_data)
+        img = Image.open(io.BytesIO(image_data))
+        if draft_size:
+            img.draft('L', draft_size)
+        return img.convert('L')  # Grayscale
+    except Exception as e:
+        raise ValueError(f"Failed to process image: {str(e)}")
+
+
+def make_thumbnail(img, size=None):
+    """Small uint8 thumbnail used for the cheap quality gate"""
+    size = size or QUALITY_THUMBNAIL_SIZE
+    return np.asarray(img.resize((size, size), Image.Resampling.BILINEAR), dtype=np.uint8)
+
+
+def image_to_array(img, target_size=224, out=None):
+    """Resize a decoded grayscale image and apply xrv normalization.
+
+    Returns a (1, target_size, target_size) float32 array, written into ``out``
+    when given. Matches ``xrv.utils.normalize(x / 255.0, maxval=1.0)``, which
+    maps [0, 1] to the [-1024, 1024] range the xrv models expect.
+    """
+    try:
+        # Resize
+        img = img.resize((target_size, target_size), Image.Resampling.LANCZOS)
+
+        # Convert to numpy array (0-255)
+        img_np = np.asarray(img, dtype=np.float32).reshape(1, target_size, target_size)
+        if out is None:
+            out = np.empty((1, target_size, target_size), dtype=np.float32)
+
+        # (2 * (x / 255) - 1) * 1024, computed in place
+        np.multiply(img_np, 2048.0 / 255.0, out=out)
+        out -= 1024.0
+        return out
+    except Exception as e:
+        raise ValueError(f"Failed to process image: {str(e)}")
+
+
+def quality_metrics_batch(thumbnails):
+    """Exposure, contrast and blur metrics for a (N, H, W) uint8 thumbnail stack"""
+    imgs = np.asarray(thumbnails, dtype=np.float32)
+    lo = imgs.min(axis=(1, 2), keepdims=True)
+    hi = imgs.max(axis=(1, 2), keepdims=True)
+    imgs = (imgs - lo) / (hi - lo + 1e-8)
+    mean_intensity = imgs.mean(axis=(1, 2))
+    std_intensity = imgs.std(axis=(1, 2))
+    # Blur estimate via Laplacian variance
+    blur_score = np.diff(imgs, axis=1).var(axis=(1, 2)) + np.diff(imgs, axis=2).var(axis=(1, 2))
+    return mean_intensity, std_intensity, blur_score
+
+
+def assess_thumbnail_quality(thumbnails):
+    """Basic image quality checks to guard against low-quality inputs.
+
+    Works on a batch of uint8 thumbnails so unusable uploads can be stopped
+    before normalization and inference. Returns one report per thumbnail.
+    """
+    try:
+        thumbnails = np.asarray(thumbnails)
+        mean_intensity, std_intensity, blur_score = quality_metrics_batch(thumbnails)
+
+        reports = []
+        for mean, std, blur in zip(mean_intensity.tolist(), std_intensity.tolist(), blur_score.tolist()):
+            issues = []
+            if mean < 0.15 or mean > 0.85:
+                issues.append("exposure")
+            if std < 0.08:
+                issues.append("low_contrast")
+            if blur < QUALITY_BLUR_THRESHOLD:
+                issues.append("blurry")
+
+            reports.append({
+                "quality": "good" if len(issues) == 0 else "poor",
+                "issues": issues,
+                "mean_intensity": round(mean, 3),
+                "std_intensity": round(std, 3),
+                "blur_score": round(blur, 6),
+            })
+        return reports
+    except Exception as e:
+        return [{
+            "quality": "unknown",
+            "issues": ["quality_check_failed"],
+            "error": str(e),
+        } for _ in range(len(thumbnails))]
+
+
+def extract_mammo_features(image):
+    """Extract simple statistical features from mammography image"""
+    img = image.convert('L')
+    img = img.resize((100, 100))
+    arr = np.array(img)
+
+    features = []
+    features.append(np.mean(arr) / 255.0 * 30)
+    features.append(np.std(arr) / 255.0 * 30)
+    features.append(np.percentile(arr, 90) / 255.0 * 100)
+    features.append(np.sum(arr > 128) / arr.size * 1000)
+
+    h, w = arr.shape
+    for region in [
+        arr[:h//2, :w//2],
+        arr[:h//2, w//2:],
+        arr[h//2:, :w//2],
+        arr[h//2:, w//2:],
+        arr[h//3:2*h//3, w//3:2*w//3],
+    ]:
+        features.append(np.mean(region) / 255.0 * 30)
+        features.append(np.std(region) / 255.0 * 30)
+        features.append(np.percentile(region, 75) / 255.0 * 30)
+        features.append(np.percentile(region, 25) / 255.0 * 30)
+
+    edges = np.abs(np.diff(arr, axis=0)).mean() + np.abs(np.diff(arr, axis=1)).mean()
+    features.append(edges / 255.0 * 10)
+
+    while len(features) < 30:
+        features.append(features[len(features) % 10])
+
+    return features[:30]
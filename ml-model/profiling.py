@@ -0,0 +1,248 @@
+"""
+On-demand profiling for the ML gateway
+Three independent tools, all idle (and free) until an admin arms them, that
+write their results as files under one directory for download:
+
+- StackSampler: samples every Python thread's stack for N seconds and writes
+  folded stacks (one "frame;frame;frame count" line each, the input format of
+  flamegraph.pl / speedscope).
+- TorchTrace: wraps the next K DenseNet forward passes in torch.profiler and
+  writes a Chrome trace per pass plus an operator summary.
+- EndpointProfiler: swaps a Flask view for a cProfile-wrapped copy for the
+  next N requests and writes the merged pstats (plus a text report). The
+  original view is put back afterwards, so nothing is left in the hot path.
+  cProfile only sees the request thread, so callers check profiling_thread()
+  to run work inline that they would otherwise hand to a batching thread.
+"""
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import collections
+import functools
+
+import torch
+
+
+def _timestamp():
+    return time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+
+
+class StackSampler:
+    def __init__(self, directory):
+        self.directory = directory
+        self._thread = None
+        self.current = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, interval_ms=10.0):
+        if self.running:
+            raise RuntimeError("A stack sampling session is already running")
+        name = f"stacks-{_timestamp()}.folded"
+        self.current = {'file': name, 'seconds': seconds, 'interval_ms': interval_ms, 'samples': 0}
+        self._thread = threading.Thread(
+            target=self._run, args=(name, seconds, interval_ms / 1000.0), name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+        return dict(self.current)
+
+    def _run(self, name, seconds, interval):
+        own = threading.get_ident()
+        thread_names = {}
+        counts = collections.Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            if len(thread_names) != threading.active_count():
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, str(ident)))
+                counts[";".join(reversed(stack))] += 1
+            self.current['samples'] += 1
+            time.sleep(interval)
+
+        with open(os.path.join(self.directory, name), "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"[PROFILE] Wrote {self.current['samples']} stack samples to {name}")
+
+
+class TorchTrace:
+    """Profile the next K forward passes; callers check ``armed`` before calling ``capture``"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.armed = False
+        self.current = None
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def arm(self, passes):
+        with self._lock:
+            if self.armed:
+                raise RuntimeError("A torch trace is already armed")
+            self.current = {'prefix': f"torch-{_timestamp()}", 'passes': passes, 'captured': 0, 'files': []}
+            self._totals = {}
+            self.armed = True
+        return dict(self.current)
+
+    def capture(self, fn, *args):
+        # Serialized so each trace holds exactly one pass
+        with self._lock:
+            if not self.armed:
+                return fn(*args)
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True) as prof:
+                result = fn(*args)
+            self.current['captured'] += 1
+            name = f"{self.current['prefix']}-{self.current['captured']}.json"
+            prof.export_chrome_trace(os.path.join(self.directory, name))
+            self.current['files'].append(name)
+            for event in prof.key_averages():
+                total = self._totals.setdefault(event.key, [0, 0.0, 0.0])
+                total[0] += event.count
+                total[1] += event.self_cpu_time_total
+                total[2] += event.cpu_time_total
+            if self.current['captured'] >= self.current['passes']:
+                self.armed = False
+                self._write_summary()
+            return result
+
+    def _write_summary(self):
+        name = f"{self.current['prefix']}-summary.txt"
+        rows = sorted(self._totals.items(), key=lambda kv: kv[1][1], reverse=True)
+        with open(os.path.join(self.directory, name), "w") as f:
+            f.write(f"{self.current['captured']} forward passes\n\n")
+            f.write(f"{'operator':<50} {'calls':>8} {'self cpu ms':>12} {'total cpu ms':>13}\n")
+            for key, (count, self_us, total_us) in rows:
+                f.write(f"{key[:50]:<50} {count:>8} {self_us / 1000:>12.2f} {total_us / 1000:>13.2f}\n")
+        self.current['files'].append(name)
+        print(f"[PROFILE] Wrote torch trace of {self.current['captured']} passes to {self.current['prefix']}-*")
+
+
+class EndpointProfiler:
+    def __init__(self, app, directory):
+        self.app = app
+        self.directory = directory
+        self.current = None
+        self._original = None
+        self._stats = None
+        self._lock = threading.RLock()
+        # cProfile allows one active profiler per process on Python 3.12+, so
+        # concurrent requests to the endpoint run unprofiled rather than wait
+        self._busy = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def running(self):
+        return self.current is not None and self._original is not None
+
+    def profiling_thread(self):
+        """Whether the calling thread is serving a profiled request"""
+        return getattr(self._local, 'active', False)
+
+    def start(self, endpoint, requests):
+        with self._lock:
+            if self.running:
+                raise RuntimeError(f"Already profiling endpoint {self.current['endpoint']}")
+            if endpoint not in self.app.view_functions:
+                raise ValueError(f"Unknown endpoint {endpoint}")
+            self.current = {
+                'endpoint': endpoint, 'requests': requests, 'profiled': 0, 'skipped': 0,
+                'file': f"cprofile-{endpoint}-{_timestamp()}.prof",
+            }
+            self._stats = None
+            self._original = self.app.view_functions[endpoint]
+            self.app.view_functions[endpoint] = self._wrap(self._original)
+        return dict(self.current)
+
+    def _wrap(self, view):
+        @functools.wraps(view)
+        def profiled(*args, **kwargs):
+            if not self._busy.acquire(blocking=False):
+                self.current['skipped'] += 1
+                return view(*args, **kwargs)
+            profile = cProfile.Profile()
+            self._local.active = True
+            try:
+                return profile.runcall(view, *args, **kwargs)
+            finally:
+                self._local.active = False
+                self._busy.release()
+                self._record(profile)
+        return profiled
+
+    def _record(self, profile):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.current['profiled'] += 1
+            done = self.current['profiled'] >= self.current['requests']
+        if done:
+            self.stop()
+
+    def stop(self):
+        """Restore the original view and write what was collected"""
+        with self._lock:
+            if not self.running:
+                return dict(self.current) if self.current else None
+            self.app.view_functions[self.current['endpoint']] = self._original
+            self._original = None
+            if self._stats is not None:
+                path = os.path.join(self.directory, self.current['file'])
+                self._stats.dump_stats(path)
+                with open(path[:-len(".prof")] + ".txt", "w") as f:
+                    f.write(self.report(limit=80))
+                print(f"[PROFILE] Wrote cProfile of {self.current['profiled']} {self.current['endpoint']} requests")
+            return dict(self.current)
+
+    def report(self, limit=30):
+        """Top functions by cumulative time collected so far"""
+        with self._lock:
+            if self._stats is None:
+                return ""
+            out = io.StringIO()
+            out.write("Request thread only: model forwards run inline while profiled; preprocessing-pool\n"
+                      "workers, the shadow worker and other threads appear as time spent waiting.\n\n")
+            self._stats.stream = out
+            self._stats.sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+
+
+class ProfilingTools:
+    def __init__(self, app, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.stacks = StackSampler(directory)
+        self.torch = TorchTrace(directory)
+        self.endpoint = EndpointProfiler(app, directory)
+
+    def files(self):
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                entries.append({'name': name, 'bytes': os.path.getsize(path)})
+        return entries
+
+    def status(self):
+        return {
+            'directory': self.directory,
+            'stacks': dict(self.stacks.current, running=self.stacks.running) if self.stacks.current else None,
+            'torch': dict(self.torch.current, armed=self.torch.armed) if self.torch.current else None,
+            'endpoint': dict(self.endpoint.current, running=self.endpoint.running) if self.endpoint.current else None,
+            'files': self.files(),
+        }
@@ -0,0 +1,184 @@
+"""
+Shadow model evaluation
+Mirrors a sampled fraction of live inputs to a candidate model without touching
+the primary request: the input is queued only once the response has been sent,
+and a single low-priority worker thread runs the candidate and logs both
+outputs, one compact JSON line per comparison, with agreement and latency
+statistics kept in memory for the stats endpoint.
+
+The shadow path has a hard CPU cap. After every job the worker sleeps until the
+process CPU time consumed during the job, which bounds what the candidate used
+from above, is at most cpu_fraction of the machine's CPUs over the job plus the
+sleep. When primary traffic is heavy, its CPU time is counted as well, so the
+shadow backs off further. The queue is bounded, and inputs sampled while it is
+full are dropped rather than waited for.
+"""
+import os
+import json
+import time
+import random
+import queue
+import threading
+import collections
+
+
+class ShadowCandidate:
+    def __init__(self, name, run, compare):
+        self.name = name
+        # run(inputs) -> candidate output; compare(primary, output) -> dict with 'agree'
+        self.run = run
+        self.compare = compare
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+class ShadowEvaluator:
+    def __init__(self, log_path, sample_rate=0.05, queue_size=16, cpu_fraction=0.25, cpus=1,
+                 log_max_mb=64, nice=19, window=1000):
+        self.log_path = log_path
+        self.sample_rate = sample_rate
+        self.cpu_fraction = cpu_fraction
+        self.cpus = cpus
+        self.log_max_bytes = int(log_max_mb * 1e6)
+        self.nice = nice
+        self.candidates = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._latency = {}
+        self._window = window
+        self._thread = None
+        self.cpu_seconds = 0.0
+        self.throttled_seconds = 0.0
+
+    def register(self, kind, candidate):
+        with self._lock:
+            self.candidates[kind] = candidate
+            self._counters[kind] = {'sampled': 0, 'dropped': 0, 'completed': 0, 'errors': 0, 'agreed': 0}
+            self._latency[kind] = {
+                'primary_ms': collections.deque(maxlen=self._window),
+                'shadow_ms': collections.deque(maxlen=self._window),
+                'queue_ms': collections.deque(maxlen=self._window),
+            }
+
+    def sample(self, kind):
+        """Whether to mirror this request; cheap enough to call on every request"""
+        return kind in self.candidates and random.random() < self.sample_rate
+
+    def submit(self, kind, inputs, primary, primary_ms):
+        """Queue a sampled input (called after the response is sent); drops when the queue is full"""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((kind, inputs, primary, primary_ms, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._counters[kind]['dropped'] += 1
+            return False
+        with self._lock:
+            self._counters[kind]['sampled'] += 1
+        return True
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+                self._thread = threading.Thread(target=self._loop, name="shadow-eval", daemon=True)
+                self._thread.start()
+
+    def _lower_priority(self):
+        # Linux niceness is per thread; threads this one starts (e.g. torch's OpenMP team) inherit it
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError) as e:
+            print(f"[SHADOW] Could not lower worker priority: {e}")
+
+    def _loop(self):
+        self._lower_priority()
+        while True:
+            kind, inputs, primary, primary_ms, queued_at = self._queue.get()
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            record = self._evaluate(kind, inputs, primary, primary_ms, (wall_start - queued_at) * 1000)
+            del inputs
+            cpu = time.process_time() - cpu_start
+            wall = time.perf_counter() - wall_start
+            if record is not None:
+                self._write(record)
+
+            # Duty cycle: sleep until cpu / (wall + pause) <= cpu_fraction * cpus
+            pause = max(0.0, cpu / (self.cpu_fraction * self.cpus) - wall)
+            with self._lock:
+                self.cpu_seconds += cpu
+                self.throttled_seconds += pause
+            if pause:
+                time.sleep(pause)
+
+    def _evaluate(self, kind, inputs, primary, primary_ms, queue_ms):
+        candidate = self.candidates[kind]
+        start = time.perf_counter()
+        try:
+            output = candidate.run(inputs)
+            shadow_ms = (time.perf_counter() - start) * 1000
+            comparison = candidate.compare(primary, output)
+        except Exception as e:
+            with self._lock:
+                self._counters[kind]['errors'] += 1
+            print(f"[SHADOW] {kind} candidate {candidate.name} failed: {e}")
+            return None
+
+        with self._lock:
+            counters = self._counters[kind]
+            counters['completed'] += 1
+            counters['agreed'] += bool(comparison.get('agree'))
+            latency = self._latency[kind]
+            latency['primary_ms'].append(primary_ms)
+            latency['shadow_ms'].append(shadow_ms)
+            latency['queue_ms'].append(queue_ms)
+        return {
+            'ts': round(time.time(), 3),
+            'kind': kind,
+            'candidate': candidate.name,
+            'primary_ms': round(primary_ms, 1),
+            'shadow_ms': round(shadow_ms, 1),
+            'queue_ms': round(queue_ms, 1),
+            **comparison,
+        }
+
+    def _write(self, record):
+        try:
+            if self.log_max_bytes and os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.log_max_bytes:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        except OSError as e:
+            print(f"[SHADOW] Could not write log: {e}")
+
+    def stats(self):
+        with self._lock:
+            kinds = {}
+            for kind, candidate in self.candidates.items():
+                counters = dict(self._counters[kind])
+                latency = {key: list(values) for key, values in self._latency[kind].items()}
+                entry = dict(counters, candidate=candidate.name)
+                entry['agreement'] = round(counters['agreed'] / counters['completed'], 4) if counters['completed'] else None
+                for key, values in latency.items():
+                    entry[key] = {'p50': _percentile(values, 0.5), 'p95': _percentile(values, 0.95)}
+                kinds[kind] = entry
+            return {
+                'sample_rate': self.sample_rate,
+                'cpu_fraction': self.cpu_fraction,
+                'cpus': self.cpus,
+                'queued': self._queue.qsize(),
+                'queue_size': self._queue.maxsize,
+                'cpu_seconds': round(self.cpu_seconds, 2),
+                'throttled_seconds': round(self.throttled_seconds, 2),
+                'log': self.log_path,
+                'candidates': kinds,
+            }
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+from admission import (
+    AdmissionController, AdmissionRejected, MemoryBudgetExceeded, PixelBudgetExceeded,
+)
+
+MB = 1_000_000
+
+
+def controller(budget_mb=100, **kwargs):
+    kwargs.setdefault("queue_timeout", 2.0)
+    return AdmissionController(budget_mb * MB, max_pixels=1000 * 1000, **kwargs)
+
+
+def test_acquire_and_release_track_in_flight_bytes():
+    admission = controller()
+    ticket = admission.acquire(30 * MB)
+    assert admission.stats()["in_flight_mb"] == 30.0
+    admission.release(ticket)
+    stats = admission.stats()
+    assert stats["in_flight_mb"] == 0.0
+    assert stats["admitted"] == 1
+
+
+def test_request_larger_than_budget_is_rejected_at_once():
+    admission = controller(queue_timeout=10.0)
+    start = time.perf_counter()
+    with pytest.raises(MemoryBudgetExceeded) as e:
+        admission.acquire(101 * MB)
+    assert e.value.status == 413
+    assert time.perf_counter() - start < 1.0
+    assert admission.stats()["rejected_memory"] == 1
+
+
+def test_pixel_budget():
+    admission = controller()
+    admission.check_pixels({"width": 1000, "height": 1000})
+    with pytest.raises(PixelBudgetExceeded) as e:
+        admission.check_pixels({"width": 1001, "height": 1000})
+    assert e.value.status == 413
+
+
+def test_waits_for_room_then_admits():
+    admission = controller()
+    held = admission.acquire(80 * MB)
+    threading.Timer(0.2, admission.release, args=(held,)).start()
+    ticket = admission.acquire(50 * MB)
+    assert ticket.waited_ms >= 150
+    stats = admission.stats()
+    assert stats["queued"] == 1
+    assert stats["in_flight_mb"] == 50.0
+    admission.release(ticket)
+
+
+def test_wait_times_out_with_retryable_rejection():
+    admission = controller(queue_timeout=0.1)
+    held = admission.acquire(80 * MB)
+    with pytest.raises(AdmissionRejected) as e:
+        admission.acquire(50 * MB)
+    assert e.value.status == 503
+    assert e.value.retry_after == 1
+    stats = admission.stats()
+    assert stats["rejected_busy"] == 1
+    assert stats["waiting"] == 0
+    assert stats["in_flight_mb"] == 80.0
+    admission.release(held)
+
+
+def test_full_queue_rejects_without_waiting():
+    admission = controller(max_waiting=0, queue_timeout=10.0)
+    held = admission.acquire(80 * MB)
+    start = time.perf_counter()
+    with pytest.raises(AdmissionRejected):
+        admission.acquire(50 * MB)
+    assert time.perf_counter() - start < 1.0
+    admission.release(held)
+
+
+def test_resize_grows_and_shrinks_reservation():
+    admission = controller()
+    ticket = admission.acquire(20 * MB)
+    admission.resize(ticket, 60 * MB)
+    assert admission.stats()["in_flight_mb"] == 60.0
+    admission.resize(ticket, 20 * MB)
+    assert admission.stats()["in_flight_mb"] == 20.0
+    assert ticket.report()["estimate_mb"] == 60.0
+    admission.release(ticket)
+    assert admission.stats()["in_flight_mb"] == 0.0
+
+
+def test_resize_beyond_budget_is_413_and_leaves_nothing_held():
+    admission = controller(queue_timeout=10.0)
+    ticket = admission.acquire(60 * MB)
+    start = time.perf_counter()
+    with pytest.raises(MemoryBudgetExceeded):
+        admission.resize(ticket, 120 * MB)
+    assert time.perf_counter() - start < 1.0
+    admission.release(ticket)
+    assert admission.stats()["in_flight_mb"] == 0.0
+
+
+def test_growing_requests_do_not_block_each_other():
+    # Each holds 40 MB and needs 70 MB: holding while waiting would deadlock both
+    admission = controller(queue_timeout=5.0)
+    tickets = [admission.acquire(40 * MB), admission.acquire(40 * MB)]
+    barrier = threading.Barrier(2)
+    errors = []
+
+    def escalate(ticket):
+        barrier.wait()
+        try:
+            admission.resize(ticket, 70 * MB)
+            time.sleep(0.05)
+            admission.resize(ticket, 40 * MB)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            admission.release(ticket)
+
+    threads = [threading.Thread(target=escalate, args=(t,)) for t in tickets]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert time.perf_counter() - start < 2.0
+    assert admission.stats()["in_flight_mb"] == 0.0
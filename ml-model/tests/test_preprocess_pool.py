@@ -0,0 +1,112 @@
+import io
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from preprocess_pool import PreprocessPool
+
+
+def png_bytes(size=64):
+    gradient = np.tile(np.linspace(0, 255, size, dtype=np.uint8), (size, 1))
+    buffer = io.BytesIO()
+    Image.fromarray(gradient, mode="L").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def broken_future():
+    future = Future()
+    future.set_exception(BrokenProcessPool("worker died"))
+    return future
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def all_slots_free(pool):
+    return pool._free.qsize() == pool.num_slots and not pool._holders
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = PreprocessPool(workers=1, slots=3, target_size=32, thumbnail_size=16, timeout=30.0)
+    yield pool
+    pool.close()
+
+
+def test_slot_is_held_until_the_consumer_releases_it(pool):
+    with pool.preprocess(png_bytes()) as item:
+        assert item.array.shape == (1, 1, 32, 32)
+        assert pool._holders == {item.slot: 1}  # the worker is done, the consumer still holds it
+        assert pool._free.qsize() == pool.num_slots - 1
+    assert all_slots_free(pool)
+
+
+def test_imap_releases_every_slot(pool):
+    images = [png_bytes()] * 5 + [b"not an image"]
+    results = []
+    for item in pool.imap(images):
+        if isinstance(item, Exception):
+            results.append(item)
+            continue
+        results.append(item.array.copy())
+        item.release()
+    assert isinstance(results[-1], ValueError)
+    assert all(r.shape == (1, 1, 32, 32) for r in results[:-1])
+    assert all_slots_free(pool)
+
+
+def test_imap_closed_early_frees_pending_slots(pool):
+    stream = pool.imap([png_bytes()] * 5)
+    first = next(stream)
+    first.release()
+    stream.close()  # the jobs already started for items 2.. are abandoned
+    wait_for(lambda: all_slots_free(pool))
+
+
+def test_crashed_worker_is_replaced_and_the_job_retried(pool, monkeypatch):
+    submit = pool._submit
+    calls = []
+
+    def crash_first(slot, image_data, reject_poor):
+        calls.append(slot)
+        if len(calls) == 1:
+            return pool._executor, broken_future()
+        return submit(slot, image_data, reject_poor)
+
+    monkeypatch.setattr(pool, "_submit", crash_first)
+    restarts = pool.restarts
+    with pool.preprocess(png_bytes()) as item:
+        assert item.array is not None
+    assert len(calls) == 2 and calls[0] == calls[1]  # retried into the same slot
+    assert pool.restarts == restarts + 1
+    assert all_slots_free(pool)
+
+
+def test_failed_retry_releases_the_slot(pool, monkeypatch):
+    calls = []
+
+    def crash_then_fail(slot, image_data, reject_poor):
+        calls.append(slot)
+        if len(calls) == 1:
+            return pool._executor, broken_future()
+        raise RuntimeError("cannot start workers")
+
+    monkeypatch.setattr(pool, "_submit", crash_then_fail)
+    with pytest.raises(RuntimeError):
+        pool.preprocess(png_bytes())
+    assert all_slots_free(pool)
+
+
+def test_second_crash_gives_up_and_releases_the_slot(pool, monkeypatch):
+    monkeypatch.setattr(pool, "_submit", lambda *args: (pool._executor, broken_future()))
+    with pytest.raises(ValueError, match="worker crashed"):
+        pool.preprocess(png_bytes())
+    assert all_slots_free(pool)
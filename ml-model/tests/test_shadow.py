@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+
+from shadow import ShadowCandidate, ShadowEvaluator
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def compare(primary, output):
+    return {"agree": primary == output}
+
+
+def test_sampling_needs_a_registered_candidate(tmp_path):
+    shadow = ShadowEvaluator(str(tmp_path / "log.jsonl"), sample_rate=1.0)
+    assert not shadow.sample("chest")
+    shadow.register("chest", ShadowCandidate("candidate", lambda x: x, compare))
+    assert shadow.sample("chest")
+    shadow.sample_rate = 0.0
+    assert not shadow.sample("chest")
+
+
+def test_comparisons_are_logged_with_agreement(tmp_path):
+    log = tmp_path / "log.jsonl"
+    shadow = ShadowEvaluator(str(log), cpu_fraction=1.0)
+    shadow.register("chest", ShadowCandidate("candidate", lambda x: x * 2, compare))
+    shadow.submit("chest", 2, 4, primary_ms=10.0)
+    shadow.submit("chest", 3, 5, primary_ms=12.0)
+    wait_for(lambda: shadow.stats()["candidates"]["chest"]["completed"] == 2)
+
+    stats = shadow.stats()["candidates"]["chest"]
+    assert stats["agreed"] == 1
+    assert stats["agreement"] == 0.5
+    records = [json.loads(line) for line in log.read_text().splitlines()]
+    assert [r["agree"] for r in records] == [True, False]
+    assert records[0]["candidate"] == "candidate"
+    assert records[0]["primary_ms"] == 10.0
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    started = threading.Event()
+    unblock = threading.Event()
+
+    def run(x):
+        started.set()
+        unblock.wait(5)
+        return x
+
+    shadow = ShadowEvaluator(str(tmp_path / "log.jsonl"), queue_size=1, cpu_fraction=1.0)
+    shadow.register("chest", ShadowCandidate("candidate", run, compare))
+    assert shadow.submit("chest", 1, 1, 1.0)
+    started.wait(5)  # the worker holds job 1; the queue is empty again
+    assert shadow.submit("chest", 2, 2, 1.0)
+
+    start = time.perf_counter()
+    assert not shadow.submit("chest", 3, 3, 1.0)
+    assert time.perf_counter() - start < 0.5
+    unblock.set()
+
+    wait_for(lambda: shadow.stats()["candidates"]["chest"]["completed"] == 2)
+    stats = shadow.stats()["candidates"]["chest"]
+    assert stats["sampled"] == 2
+    assert stats["dropped"] == 1
+
+
+def test_candidate_errors_are_counted_not_logged(tmp_path):
+    log = tmp_path / "log.jsonl"
+    shadow = ShadowEvaluator(str(log), cpu_fraction=1.0)
+    shadow.register("chest", ShadowCandidate("candidate", lambda x: 1 / x, compare))
+    shadow.submit("chest", 0, 1, 1.0)
+    wait_for(lambda: shadow.stats()["candidates"]["chest"]["errors"] == 1)
+    assert not log.exists() or log.read_text() == ""
+
+
+def test_duty_cycle_caps_cpu_share(tmp_path):
+    def burn(seconds):
+        end = time.process_time() + seconds
+        while time.process_time() < end:
+            pass
+        return seconds
+
+    shadow = ShadowEvaluator(str(tmp_path / "log.jsonl"), cpu_fraction=0.25, cpus=1)
+    shadow.register("chest", ShadowCandidate("candidate", burn, compare))
+    start = time.perf_counter()
+    for _ in range(3):
+        shadow.submit("chest", 0.05, 0.05, 1.0)
+    wait_for(lambda: shadow.stats()["candidates"]["chest"]["completed"] == 3)
+    elapsed = time.perf_counter() - start
+    # Each job's CPU time and pause are recorded just after it completes
+    wait_for(lambda: shadow.stats()["cpu_seconds"] >= 0.15)
+
+    # 50 ms of CPU at a 25% share is followed by ~150 ms of sleep before the next job starts
+    assert shadow.stats()["throttled_seconds"] >= 0.3
+    assert elapsed >= 0.35
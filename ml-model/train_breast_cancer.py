@@ -1,47 +1,188 @@
 """
 Train Breast Cancer Model
+The default mode loads the whole CSV into pandas and fits a random forest.
+--stream trains out of core for feature exports too large for memory: the CSV
+is read in fixed-dtype chunks, StandardScaler is fitted with partial_fit in a
+first pass and an SGD logistic-regression model is trained with partial_fit
+over further passes, so memory stays bounded by the chunk size. Rows are
+split into train/test by a hash of their id, independent of chunking.
+
+Usage:
+    python train_breast_cancer.py
+    python train_breast_cancer.py --stream
+    python train_breast_cancer.py --stream --data features_export.csv --chunk-size 200000 --epochs 3
 """
+import time
+import argparse
+import resource
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import SGDClassifier
 import joblib
 
-# Load data
-df = pd.read_csv("data_cancer.csv")
-print("Dataset shape:", df.shape)
 
-# Drop unnecessary columns (id and empty column)
-df = df.drop(['id', 'Unnamed: 32'], axis=1)
+def train_in_memory(args):
+    # Load data
+    df = pd.read_csv(args.data)
+    print("Dataset shape:", df.shape)
+
+    # Drop unnecessary columns (id and empty column)
+    df = df.drop(['id', 'Unnamed: 32'], axis=1)
+
+    # Encode diagnosis (M=1, B=0)
+    df['diagnosis'] = df['diagnosis'].map({'M': 1, 'B': 0})
+
+    # Features and target
+    X = df.iloc[:, 1:].values  # 30 features (skip diagnosis)
+    Y = df.iloc[:, 0].values
+
+    print(f"Features shape: {X.shape}")
+    print(f"Target distribution: Benign={sum(Y==0)}, Malignant={sum(Y==1)}")
+
+    # Split
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=args.test_size, random_state=42)
+
+    # Scale
+    scaler = StandardScaler()
+    X_train = scaler.fit_transform(X_train)
+    X_test = scaler.transform(X_test)
+
+    # Train
+    model = RandomForestClassifier(n_estimators=100, random_state=42, criterion="entropy")
+    model.fit(X_train, Y_train)
+
+    # Evaluate
+    accuracy = model.score(X_test, Y_test)
+    print(f"Test accuracy: {accuracy:.4f}")
+    return model, scaler
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def csv_schema(path):
+    """Feature columns and fixed dtypes, read from the header row only"""
+    columns = pd.read_csv(path, nrows=0).columns
+    features = [c for c in columns if c not in ('id', 'diagnosis') and not c.startswith('Unnamed')]
+    dtypes = {c: np.float32 for c in features}
+    dtypes.update({'id': np.int64, 'diagnosis': 'category'})
+    return features, dtypes
+
+
+def stream_chunks(args, features, dtypes, test_fraction):
+    """Yield (X, y, is_test) per chunk; the split is a stable hash of each row's id"""
+    reader = pd.read_csv(
+        args.data,
+        usecols=['id', 'diagnosis'] + features,
+        dtype=dtypes,
+        chunksize=args.chunk_size,
+    )
+    for chunk in reader:
+        y = chunk['diagnosis'].map({'M': 1, 'B': 0}).to_numpy(dtype=np.float32)
+        X = chunk[features].to_numpy(dtype=np.float32)
+        labelled = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
+        is_test = (pd.util.hash_array(chunk['id'].to_numpy()) % 1000) < test_fraction * 1000
+        yield X[labelled], y[labelled].astype(np.int64), is_test[labelled]
+
+
+def streaming_pass(name, args, features, dtypes, handle):
+    start = time.perf_counter()
+    rows = 0
+    for X, y, is_test in stream_chunks(args, features, dtypes, args.test_size):
+        handle(X, y, is_test)
+        rows += len(y)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<12} {rows:>10} rows  {elapsed:>7.1f}s  {rows / max(elapsed, 1e-9):>10.0f} rows/s  "
+          f"peak RSS {peak_rss_mb():.0f} MB")
+    return rows, elapsed
+
+
+def train_streaming(args):
+    features, dtypes = csv_schema(args.data)
+    print(f"Streaming {args.data}: {len(features)} features, chunks of {args.chunk_size} rows")
+    rss_before = peak_rss_mb()
+    rng = np.random.default_rng(42)
+
+    scaler = StandardScaler()
+    model = SGDClassifier(loss="log_loss", alpha=args.alpha, random_state=42)
+    counts = {'train': 0, 'test': 0, 'benign': 0, 'malignant': 0}
+    total_rows = 0
+    total_time = 0.0
+
+    # Pass 1: scaler statistics (and class counts) over the training rows
+    def fit_scaler(X, y, is_test):
+        train = ~is_test
+        if train.any():
+            scaler.partial_fit(X[train])
+        counts['train'] += int(train.sum())
+        counts['test'] += int(is_test.sum())
+        counts['malignant'] += int(y.sum())
+        counts['benign'] += int(len(y) - y.sum())
+
+    rows, elapsed = streaming_pass("scaler", args, features, dtypes, fit_scaler)
+    total_rows += rows
+    total_time += elapsed
+    print(f"Target distribution: Benign={counts['benign']}, Malignant={counts['malignant']} "
+          f"(train={counts['train']}, test={counts['test']})")
+    if counts['train'] == 0:
+        raise SystemExit("No training rows found")
+
+    # Passes 2..: SGD over scaled, chunk-shuffled training rows
+    def fit_model(X, y, is_test):
+        train = ~is_test
+        if not train.any():
+            return
+        order = rng.permutation(int(train.sum()))
+        model.partial_fit(scaler.transform(X[train])[order], y[train][order], classes=[0, 1])
+
+    for epoch in range(args.epochs):
+        rows, elapsed = streaming_pass(f"epoch {epoch + 1}", args, features, dtypes, fit_model)
+        total_rows += rows
+        total_time += elapsed
+
+    # Final pass: held-out accuracy
+    scores = {'correct': 0, 'total': 0}
+
+    def evaluate(X, y, is_test):
+        if is_test.any():
+            scores['correct'] += int((model.predict(scaler.transform(X[is_test])) == y[is_test]).sum())
+            scores['total'] += int(is_test.sum())
 
-# Encode diagnosis (M=1, B=0)
-df['diagnosis'] = df['diagnosis'].map({'M': 1, 'B': 0})
+    rows, elapsed = streaming_pass("evaluate", args, features, dtypes, evaluate)
+    total_rows += rows
+    total_time += elapsed
 
-# Features and target
-X = df.iloc[:, 1:].values  # 30 features (skip diagnosis)
-Y = df.iloc[:, 0].values
+    if scores['total']:
+        print(f"Test accuracy: {scores['correct'] / scores['total']:.4f}")
+    print(f"Streamed {total_rows} rows in {total_time:.1f}s ({total_rows / max(total_time, 1e-9):.0f} rows/s), "
+          f"peak RSS {peak_rss_mb():.0f} MB (started at {rss_before:.0f} MB)")
+    return model, scaler
 
-print(f"Features shape: {X.shape}")
-print(f"Target distribution: Benign={sum(Y==0)}, Malignant={sum(Y==1)}")
 
-# Split
-X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
+def main():
+    parser = argparse.ArgumentParser(description="Train the breast cancer feature model")
+    parser.add_argument("--data", default="data_cancer.csv")
+    parser.add_argument("--stream", action="store_true", help="Out-of-core training with bounded memory")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Rows per chunk in --stream mode")
+    parser.add_argument("--epochs", type=int, default=5, help="SGD passes over the data in --stream mode")
+    parser.add_argument("--alpha", type=float, default=1e-4, help="SGD L2 regularization in --stream mode")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--model-out", default="breast_cancer_model.joblib")
+    parser.add_argument("--scaler-out", default="breast_cancer_scaler.joblib")
+    args = parser.parse_args()
 
-# Scale
-scaler = StandardScaler()
-X_train = scaler.fit_transform(X_train)
-X_test = scaler.transform(X_test)
+    model, scaler = train_streaming(args) if args.stream else train_in_memory(args)
 
-# Train
-model = RandomForestClassifier(n_estimators=100, random_state=42, criterion="entropy")
-model.fit(X_train, Y_train)
+    # Save
+    joblib.dump(model, args.model_out)
+    joblib.dump(scaler, args.scaler_out)
+    print("Model saved!")
 
-# Evaluate
-accuracy = model.score(X_test, Y_test)
-print(f"Test accuracy: {accuracy:.4f}")
 
-# Save
-joblib.dump(model, "breast_cancer_model.joblib")
-joblib.dump(scaler, "breast_cancer_scaler.joblib")
-print("Model saved!")
+if __name__ == "__main__":
+    main()